@@ -0,0 +1,117 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import sys
+import time
+from threading import Lock
+from typing import Iterator
+
+from settings import ARTIFACTS_DIR
+
+SECTIONS = ("network_log", "assets", "failed_downloads", "verdicts", "failed_ads")
+
+
+class ArtifactBundle:
+    """Per-run store for the crawler's per-site text artifacts.
+
+    Every process writes its own shard of a run: a data file of concatenated gzip
+    members, one per (site, section) write, holding JSON Lines, and an append-only
+    index of where each member starts. Readers find a site's data through the
+    indexes and decompress only that member. A section written again for the same
+    site (a retried stage) supersedes the earlier member.
+    """
+
+    def __init__(self, run_id: int, worker_id: str = "reader", root: str = ARTIFACTS_DIR) -> None:
+        self.run_id = run_id
+        self.directory = os.path.join(root, f"run_{run_id}")
+        self.shard = re.sub(r"[^\w.-]", "_", worker_id)
+        self._lock = Lock()
+        self._data = None
+        self._index = None
+        self._entries = {}
+        self._index_positions = {}
+
+    def _open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._data = open(os.path.join(self.directory, f"{self.shard}.jsonl.gz"), "ab")
+        self._index = open(os.path.join(self.directory, f"{self.shard}.idx"), "a", encoding="utf-8")
+
+    def write(self, website_id: int, section: str, records: list) -> int:
+        """Append one site's records for a section as a single compressed member; returns the record count"""
+        payload = gzip.compress("".join(json.dumps(record) + "\n" for record in records).encode(), compresslevel=6)
+        with self._lock:
+            if self._data is None:
+                self._open()
+            offset = self._data.tell()
+            self._data.write(payload)
+            self._data.flush()
+            # The index line goes out only after its member is on disk, so readers never see a partial member.
+            entry = {"site": website_id, "section": section, "shard": self.shard, "offset": offset,
+                     "length": len(payload), "records": len(records), "written_at": time.time()}
+            self._index.write(json.dumps(entry) + "\n")
+            self._index.flush()
+            self._remember(entry)
+        return len(records)
+
+    def _remember(self, entry: dict) -> None:
+        key = (entry["site"], entry["section"])
+        current = self._entries.get(key)
+        if current is None or entry["written_at"] >= current["written_at"]:
+            self._entries[key] = entry
+
+    def _load_indexes(self) -> None:
+        """Read the index lines appended to every shard of the run since the last call"""
+        for path in glob.glob(os.path.join(self.directory, "*.idx")):
+            with open(path, "rb") as f:
+                f.seek(self._index_positions.get(path, 0))
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self._remember(json.loads(line))
+                    self._index_positions[path] = f.tell()
+
+    def read(self, website_id: int, section: str) -> Iterator[dict]:
+        """Stream the latest records of one site's section"""
+        with self._lock:
+            self._load_indexes()
+            entry = self._entries.get((website_id, section))
+        if entry is None:
+            return
+        with open(os.path.join(self.directory, f"{entry['shard']}.jsonl.gz"), "rb") as f:
+            f.seek(entry["offset"])
+            payload = f.read(entry["length"])
+        for line in gzip.decompress(payload).decode().splitlines():
+            yield json.loads(line)
+
+    def sites(self) -> list[int]:
+        with self._lock:
+            self._load_indexes()
+            return sorted({site for site, _ in self._entries})
+
+    def close(self) -> None:
+        with self._lock:
+            for f in (self._data, self._index):
+                if f:
+                    f.close()
+            self._data = self._index = None
+
+    @staticmethod
+    def runs(root: str = ARTIFACTS_DIR) -> list[int]:
+        return sorted(int(os.path.basename(path)[4:]) for path in glob.glob(os.path.join(root, "run_*")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print artifacts stored for a crawl run as JSON Lines")
+    parser.add_argument("run_id", type=int)
+    parser.add_argument("section", choices=SECTIONS)
+    parser.add_argument("--site", type=int, help="website_id (default: every site of the run)")
+    parser.add_argument("--root", default=ARTIFACTS_DIR)
+    args = parser.parse_args()
+
+    bundle = ArtifactBundle(args.run_id, root=args.root)
+    for website_id in [args.site] if args.site is not None else bundle.sites():
+        for record in bundle.read(website_id, args.section):
+            sys.stdout.write(json.dumps({"site": website_id, **record}) + "\n")
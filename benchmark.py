@@ -0,0 +1,272 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from artifacts import ArtifactBundle
+from checker import ADChecker, RuleSet, TrackingChecker
+from metrics import CrawlMetrics
+from request_context import RequestContext
+from rules_parser import ELParser
+from settings import ARTIFACTS_DIR, BENCHMARK_DIR, BENCHMARK_MAX_SLOWDOWN, BENCHMARK_SYNTHETIC_URLS, PROFILE_TOP_N, RULES_LISTS
+
+SNAPSHOT_DIR = os.path.join(BENCHMARK_DIR, "lists")
+MANIFEST_PATH = os.path.join(SNAPSHOT_DIR, "manifest.json")
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+# Snapshot of the requests in the crawl bundles, which keep growing with every crawl.
+RECORDED_CORPUS = "recorded_corpus"
+RECORDED_CORPUS_PATH = os.path.join(SNAPSHOT_DIR, f"{RECORDED_CORPUS}.jsonl")
+
+# Metrics where a larger value is a regression, with an absolute allowance for timer noise on tiny values;
+# throughputs are compared the other way round.
+LOWER_IS_BETTER = {"parse_seconds": 0.05, "index_seconds": 0.05, "p99_ms": 0.05}
+
+HOSTS = ["example.com", "news.example.org", "cdn.jsdelivr.net", "www.google-analytics.com",
+         "doubleclick.net", "static.shop.io", "pixel.tracker.net", "img.media-site.com"]
+PATH_WORDS = ["ads", "banner", "track", "pixel", "analytics", "static", "img", "js", "lib", "v1",
+              "assets", "beacon", "collect", "adserver", "sponsor", "main", "vendor", "widget"]
+EXTENSIONS = [".js", ".png", ".gif", ".css", ".json", "", ".html", ".jpg"]
+TYPES = ["script", "image", "stylesheet", "xmlhttprequest", "document", "media", "other"]
+
+
+def pin_snapshot(source_dir: str = os.path.join("data", "rules_lists", "Lists")) -> dict:
+    """Copy the current rule lists and recorded requests into the benchmark snapshot and record their hashes"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    manifest = {}
+    for name in RULES_LISTS:
+        target = os.path.join(SNAPSHOT_DIR, f"{name}.txt")
+        shutil.copyfile(os.path.join(source_dir, f"{name}.txt"), target)
+        manifest[name] = _sha256(target)
+    with open(RECORDED_CORPUS_PATH, "w") as f:
+        for request in recorded_corpus():
+            f.write(json.dumps(request) + "\n")
+    manifest[RECORDED_CORPUS] = _sha256(RECORDED_CORPUS_PATH)
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _pinned(path: str, name: str) -> str:
+    """Path of a snapshot file, refusing one that changed since pinning"""
+    with open(MANIFEST_PATH, "r") as f:
+        manifest = json.load(f)
+    if set(manifest) != set(RULES_LISTS) | {RECORDED_CORPUS}:
+        raise ValueError(f"Snapshot {sorted(manifest)} does not match RULES_LISTS {sorted(RULES_LISTS)} "
+                         f"and the recorded corpus; re-pin it")
+    if _sha256(path) != manifest[name]:
+        raise ValueError(f"Snapshot {path} does not match its pinned hash; re-pin it deliberately")
+    return path
+
+
+def load_snapshot() -> dict:
+    """Return {list name: rule lines} of the pinned lists, refusing snapshots that changed since pinning"""
+    lists = {}
+    for name in RULES_LISTS:
+        with open(_pinned(os.path.join(SNAPSHOT_DIR, f"{name}.txt"), name), "r", encoding="utf-8") as f:
+            lists[name] = f.readlines()
+    return lists
+
+
+def pinned_corpus() -> list[tuple]:
+    """The recorded requests as of the last pin, so the benchmark corpus only changes when re-pinned"""
+    with open(_pinned(RECORDED_CORPUS_PATH, RECORDED_CORPUS), "r") as f:
+        return [tuple(json.loads(line)) for line in f]
+
+
+def synthetic_corpus(count: int, seed: int = 1) -> list[tuple]:
+    """Deterministic (url, type, page_url) requests mixing first- and third-party, ad-like and plain paths"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        host, page = rng.choice(HOSTS), rng.choice(HOSTS[:3])
+        path = "/".join(rng.choice(PATH_WORDS) for _ in range(rng.randint(1, 4)))
+        query = f"?id={rng.randint(0, 99999)}" if rng.random() < 0.3 else ""
+        corpus.append((f"https://{host}/{path}{rng.choice(EXTENSIONS)}{query}", rng.choice(TYPES), f"https://{page}/"))
+    return corpus
+
+
+def recorded_corpus(root: str = ARTIFACTS_DIR) -> list[tuple]:
+    """(url, type, page_url) of every request captured in the crawler's network logs"""
+    corpus = []
+    for run_id in ArtifactBundle.runs(root):
+        bundle = ArtifactBundle(run_id, root=root)
+        for website_id in bundle.sites():
+            for entry in bundle.read(website_id, "network_log"):
+                if entry.get("method") != "Network.requestWillBeSent":
+                    continue
+                params = entry["params"]
+                corpus.append((params["request"]["url"], params.get("type", "other").lower(),
+                               params.get("documentURL", params["request"]["url"])))
+    return corpus
+
+
+def _time_matcher(match, corpus: list) -> tuple:
+    """Run match(url, type, page_url) over the corpus; returns (stats, verdict digest)"""
+    latencies = []
+    digest = hashlib.sha256()
+    started = time.perf_counter()
+    for url, resource_type, page_url in corpus:
+        call_started = time.perf_counter()
+        verdict = match(url, resource_type, page_url)
+        latencies.append(time.perf_counter() - call_started)
+        digest.update(f"{url}\t{resource_type}\t{verdict}\n".encode())
+    elapsed = time.perf_counter() - started
+    return {
+        "urls": len(corpus),
+        "urls_per_second": round(len(corpus) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(CrawlMetrics._percentile(latencies, 50) * 1000, 4),
+        "p99_ms": round(CrawlMetrics._percentile(latencies, 99) * 1000, 4),
+    }, digest.hexdigest()
+
+
+def run_benchmarks(synthetic_urls: int = BENCHMARK_SYNTHETIC_URLS, with_adtester: bool = False) -> dict:
+    """Benchmark parsing, index building and matching on the pinned lists; returns a results dict"""
+    lists = load_snapshot()
+    corpus = synthetic_corpus(synthetic_urls) + pinned_corpus()
+    results = {"corpus": len(corpus), "lists": {}, "matchers": {}, "verdicts": {}}
+
+    parsers = {}
+    for name, lines in lists.items():
+        parser = ELParser()
+        started = time.perf_counter()
+        parser.parse_rules(lines)
+        parse_seconds = time.perf_counter() - started
+        parsers[name] = parser
+        results["lists"][name] = {"rules": len(lines), "parse_seconds": round(parse_seconds, 4)}
+
+    started = time.perf_counter()
+    ad_checker = ADChecker(parser=parsers["EasyList"])
+    results["lists"]["EasyList"]["index_seconds"] = round(time.perf_counter() - started, 4)
+    started = time.perf_counter()
+    tracking_checker = TrackingChecker(parser=parsers["EasyPrivacy"])
+    results["lists"]["EasyPrivacy"]["index_seconds"] = round(time.perf_counter() - started, 4)
+
+    rules = RuleSet.from_checkers(tracking_checker, ad_checker)
+    matchers = {
+        "RuleSet.classify": lambda url, resource_type, page_url: rules.classify(
+            RequestContext.build(url, resource_type, page_url)),
+        "RuleSet.classify (uncached)": lambda url, resource_type, page_url: rules._classify(
+            RequestContext.build(url, resource_type, page_url)),
+    }
+    if with_adtester:
+        from compareParsers import AdTester
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(parsers["EasyList"].rules, f)
+        matchers["AdTester.test_url"] = AdTester(rules_file=f.name).test_url
+        os.remove(f.name)
+
+    for name, match in matchers.items():
+        results["matchers"][name], results["verdicts"][name] = _time_matcher(match, corpus)
+
+    results["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+def profile_rules(synthetic_urls: int = BENCHMARK_SYNTHETIC_URLS, top_n: int = PROFILE_TOP_N) -> dict:
+    """Per-rule cost profile of both checkers classifying the benchmark corpus, written next to the baseline"""
+    lists = load_snapshot()
+    corpus = synthetic_corpus(synthetic_urls) + pinned_corpus()
+    checkers = {}
+    for name, checker_class in (("EasyList", ADChecker), ("EasyPrivacy", TrackingChecker)):
+        parser = ELParser()
+        parser.parse_rules(lists[name])
+        checkers[name] = checker_class(parser=parser, profile=True)
+
+    # Uncached, so repeated requests are profiled too; ad rules only see what the trackers let through.
+    rules = RuleSet.from_checkers(checkers["EasyPrivacy"], checkers["EasyList"])
+    for url, resource_type, page_url in corpus:
+        rules._classify(RequestContext.build(url, resource_type, page_url))
+
+    profiles = {}
+    for name, checker in checkers.items():
+        path = os.path.join(BENCHMARK_DIR, f"rule_profile_{name}.json")
+        checker.dump_profile(path, top_n)
+        profiles[name] = path
+    return profiles
+
+
+def compare(results: dict, baseline: dict, max_slowdown: float = BENCHMARK_MAX_SLOWDOWN) -> list[str]:
+    """Regressions of results against a baseline: slowdowns beyond max_slowdown and changed verdicts"""
+    regressions = []
+    if results["corpus"] != baseline["corpus"]:
+        return [f"corpus size changed ({baseline['corpus']} -> {results['corpus']}): --urls differs or the snapshot "
+                f"was re-pinned; re-record the baseline"]
+
+    for section in ("lists", "matchers"):
+        for name, stats in results[section].items():
+            for key, value in stats.items():
+                before = baseline[section].get(name, {}).get(key)
+                if not before or key in ("rules", "urls"):
+                    continue
+                if key in LOWER_IS_BETTER and value > before * (1 + max_slowdown) + LOWER_IS_BETTER[key]:
+                    regressions.append(f"{name} {key}: {before} -> {value}")
+                elif key == "urls_per_second" and value < before * (1 - max_slowdown):
+                    regressions.append(f"{name} {key}: {before} -> {value}")
+
+    if results["max_rss_kb"] > baseline["max_rss_kb"] * (1 + max_slowdown):
+        regressions.append(f"peak RSS: {baseline['max_rss_kb']} KB -> {results['max_rss_kb']} KB")
+
+    for name, digest in results["verdicts"].items():
+        if name in baseline["verdicts"] and baseline["verdicts"][name] != digest:
+            regressions.append(f"{name} verdicts changed on the benchmark corpus")
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    print(f"{'list':<28}{'rules':>10}{'parse (s)':>12}{'index (s)':>12}")
+    for name, stats in results["lists"].items():
+        print(f"{name:<28}{stats['rules']:>10}{stats['parse_seconds']:>12.3f}{stats['index_seconds']:>12.3f}")
+    print(f"\n{'matcher':<28}{'urls':>10}{'urls/s':>12}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+    for name, stats in results["matchers"].items():
+        print(f"{name:<28}{stats['urls']:>10}{stats['urls_per_second']:>12.1f}"
+              f"{stats['p50_ms']:>12.3f}{stats['p99_ms']:>12.3f}")
+    print(f"\npeak RSS: {results['max_rss_kb'] / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline rule-parsing and matching benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("pin", help="snapshot the current rule lists and recorded requests for benchmarking")
+    run = commands.add_parser("run", help="run the benchmarks and compare them with the baseline")
+    run.add_argument("--urls", type=int, default=BENCHMARK_SYNTHETIC_URLS, help="synthetic corpus size")
+    run.add_argument("--with-adtester", action="store_true", help="also time AdTester.test_url (slow)")
+    run.add_argument("--max-slowdown", type=float, default=BENCHMARK_MAX_SLOWDOWN)
+    run.add_argument("--update-baseline", action="store_true", help="record these results as the new baseline")
+    profile = commands.add_parser("profile", help="dump the most expensive and never-matched rules")
+    profile.add_argument("--urls", type=int, default=BENCHMARK_SYNTHETIC_URLS, help="synthetic corpus size")
+    profile.add_argument("--top", type=int, default=PROFILE_TOP_N)
+    args = parser.parse_args()
+
+    if args.command == "pin":
+        for name, digest in pin_snapshot().items():
+            print(f"pinned {name}: {digest}")
+        sys.exit(0)
+    if args.command == "profile":
+        for name, path in profile_rules(args.urls, args.top).items():
+            print(f"{name} rule profile written to {path}")
+        sys.exit(0)
+
+    results = run_benchmarks(args.urls, args.with_adtester)
+    print_results(results)
+    if args.update_baseline or not os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nbaseline written to {BASELINE_PATH}")
+        sys.exit(0)
+
+    with open(BASELINE_PATH, "r") as f:
+        regressions = compare(results, json.load(f), args.max_slowdown)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
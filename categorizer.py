@@ -1,39 +1,153 @@
+import argparse
+import concurrent.futures
+import logging
+import os
+import threading
+from typing import Optional
+from urllib.parse import urlparse
+
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+from crawlerdb import crawler2db
+from settings import CATEGORIZER_WORKERS, CATEGORY_CACHE_TTL, CATEGORY_LOOKUP_TIMEOUT, CATEGORY_LOOKUP_URL
+
+SUBMIT_XPATH = ("/html/body/div[1]/div[3]/div[2]/div[2]/div/div/div/div[2]/div["
+                "1]/div/form[1]/table/tbody/tr[4]/td/div/input")
+RESULT_XPATH = ("/html/body/div[1]/div[3]/div[2]/div[2]/div/div/div/div[2]/div["
+                "1]/div/form[2]/table/tbody/tr[2]/td[4]")
+
 
-def get_domain_category(drive, url):
-    URL = f"https://sitelookup.mcafee.com/en/feedback/url?action=checksingle&url={url}"
+def get_domain_category(drive, url, lookup_url=CATEGORY_LOOKUP_URL, timeout=CATEGORY_LOOKUP_TIMEOUT):
+    URL = f"{lookup_url}?action=checksingle&url={url}"
 
     drive.get(URL)
     try:
-        WebDriverWait(drive, 10).until(
-            EC.presence_of_element_located((By.XPATH, "/html/body/div[1]/div[3]/div[2]/div[2]/div/div/div/div[2]/div["
-                                                      "1]/div/form[1]/table/tbody/tr[4]/td/div/input"))
+        WebDriverWait(drive, timeout).until(
+            EC.element_to_be_clickable((By.XPATH, SUBMIT_XPATH))
         ).click()
-        element = WebDriverWait(drive, 10).until(
-            EC.presence_of_element_located((By.XPATH, "/html/body/div[1]/div[3]/div[2]/div[2]/div/div/div/div[2]/div["
-                                                      "1]/div/form[2]/table/tbody/tr[2]/td[4]"))
+        element = WebDriverWait(drive, timeout).until(
+            EC.presence_of_element_located((By.XPATH, RESULT_XPATH))
         )
     except Exception as e:
         print(f"Error waiting for element: {e}")
         return None
 
-    return [cat.strip() for cat in element.text.replace("-", "").split("\n")]
+    return [cat.strip() for cat in element.text.replace("-", "").split("\n") if cat.strip()]
+
+
+class Categorizer:
+    """Categorizes websites through the lookup page, backed by a persistent domain cache.
+
+    Cached categories younger than the TTL are reused; cache misses are looked up
+    by a pool of browsers, one per worker thread. Every categorized website is
+    appended to the output file as soon as it is known, so an interrupted run
+    resumes with the websites that are not in the file yet.
+    """
+
+    def __init__(self, db: Optional[crawler2db] = None, workers: int = CATEGORIZER_WORKERS,
+                 ttl_seconds: int = CATEGORY_CACHE_TTL, lookup_url: str = CATEGORY_LOOKUP_URL) -> None:
+        self.db = db or crawler2db()
+        self.workers = workers
+        self.ttl_seconds = ttl_seconds
+        self.lookup_url = lookup_url
+        self._local = threading.local()
+        self._drivers = []
+        self._drivers_lock = threading.Lock()
+        self._output_lock = threading.Lock()
+
+    @staticmethod
+    def _domain(website: str) -> str:
+        return urlparse(website).netloc or website
+
+    @staticmethod
+    def _done(output_path: str) -> set:
+        """Websites already written by an earlier, possibly interrupted, run"""
+        if not os.path.exists(output_path):
+            return set()
+        with open(output_path, "r") as f:
+            return {line.split(" ::: ")[0] for line in f if " ::: " in line}
+
+    def _driver(self):
+        if getattr(self._local, "driver", None) is None:
+            options = webdriver.ChromeOptions()
+            options.add_argument("--headless=new")
+            self._local.driver = webdriver.Chrome(options=options)
+            with self._drivers_lock:
+                self._drivers.append(self._local.driver)
+        return self._local.driver
+
+    def _lookup(self, website: str) -> Optional[list]:
+        try:
+            categories = get_domain_category(self._driver(), website, self.lookup_url)
+        except Exception as e:
+            logging.error(f"Lookup failed for {website}: {e}")
+            return None
+        if categories:
+            self.db.save_domain_category(self._domain(website), categories)
+        self.db.release_session()
+        return categories
+
+    def categorize(self, websites: list[str], output_path: str) -> int:
+        """Append every not yet categorized website to output_path; returns how many were added"""
+        done = self._done(output_path)
+        pending = [website for website in dict.fromkeys(websites) if website not in done]
+        cached = self.db.get_cached_categories(list({self._domain(website) for website in pending}), self.ttl_seconds)
+        misses = [website for website in pending if self._domain(website) not in cached]
+        logging.info(f"{len(done)} websites already categorized, {len(pending) - len(misses)} cached, "
+                     f"{len(misses)} to look up")
+
+        added = 0
+        with open(output_path, "a") as f:
+            def append(website, categories):
+                with self._output_lock:
+                    f.write(f"{website} ::: {','.join(categories)}\n")
+                    f.flush()
+
+            for website in pending:
+                if self._domain(website) in cached:
+                    append(website, cached[self._domain(website)])
+                    added += 1
+
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    futures = {executor.submit(self._lookup, website): website for website in misses}
+                    for future in concurrent.futures.as_completed(futures):
+                        categories = future.result()
+                        if categories:
+                            append(futures[future], categories)
+                            added += 1
+                        else:
+                            logging.warning(f"No category found for {futures[future]}")
+            finally:
+                self.close_browsers()
+        return added
+
+    def close_browsers(self) -> None:
+        with self._drivers_lock:
+            for driver in self._drivers:
+                try:
+                    driver.quit()
+                except Exception as e:
+                    logging.error(f"Error closing browser: {e}")
+            self._drivers = []
+        self._local = threading.local()
 
 
 if __name__ == "__main__":
-    driver = webdriver.Chrome()
+    parser = argparse.ArgumentParser(description="Categorize the websites list")
+    parser.add_argument("--input", default="data/websites/websites.txt")
+    parser.add_argument("--output", default="data/websites/websites_categorized.txt")
+    parser.add_argument("--workers", type=int, default=CATEGORIZER_WORKERS)
+    parser.add_argument("--lookup-url", default=CATEGORY_LOOKUP_URL,
+                        help="lookup page, e.g. a local stand-in that mimics the form")
+    args = parser.parse_args()
+
     print("Starting categorization process...")
-    websites_path = "data/websites/websites.txt"
-    with open(websites_path, "r+") as f:
-        websites = f.readlines()
-        f.close()
-    with open("data/websites/websites_categorized.txt", "w+") as f:
-        for website in websites:
-            website = website.strip()
-            category = get_domain_category(driver, website)
-            f.write(f"{website} ::: {','.join(category)}\n")
-        f.close()
\ No newline at end of file
+    with open(args.input, "r") as f:
+        websites = [line.strip() for line in f if line.strip()]
+    categorizer = Categorizer(workers=args.workers, lookup_url=args.lookup_url)
+    print(f"{categorizer.categorize(websites, args.output)} websites categorized into {args.output}")
+    categorizer.db.close()
@@ -1,15 +1,152 @@
+import json
+import logging
 import re
+import time
 from functools import lru_cache
-from rules_parser import ELParser
-
-class ADChecker:
-    def __init__(self, parser=None, json_file=None):
+from threading import Lock
+from request_context import TYPE_BITS, RequestContext
+from rules_parser import ELParser, ruleset_version
+from settings import EASYLIST_RULES, EASYPRIVACY_RULES, MAX_RULE_WILDCARDS, PROFILE_TOP_N
+
+# A quantified group that itself contains a quantifier, e.g. (a+)+ or (?:x.*)*
+NESTED_QUANTIFIER = re.compile(r"\((?:[^()\\]|\\.)*[+*}](?:[^()\\]|\\.)*\)[+*{]")
+
+
+def split_wildcards(pattern):
+    """Split a regex on its unescaped top-level '.*' segments"""
+    pieces, current, i, depth = [], "", 0, 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            current += pattern[i:i + 2]
+            i += 2
+            continue
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        if depth == 0 and pattern.startswith(".*", i):
+            pieces.append(current)
+            current = ""
+            i += 2
+            continue
+        current += char
+        i += 1
+    pieces.append(current)
+    return pieces
+
+
+def is_pathological(pattern):
+    """Flag patterns prone to catastrophic backtracking: nested quantifiers or long '.*' chains"""
+    return bool(NESTED_QUANTIFIER.search(pattern)) or len(split_wildcards(pattern)) - 1 > MAX_RULE_WILDCARDS
+
+
+def is_regex_rule(rule):
+    """Whether a rule is a literal /regex/ rule, using the same test as ELParser._create_regex"""
+    rule_text = rule['raw'][2:] if rule['raw'].startswith('@@') else rule['raw']
+    if '$' in rule_text:
+        rule_text = rule_text.replace('$' + rule_text.split('$')[-1], '')
+    return rule_text.startswith('/') and rule_text.endswith('/') and len(rule_text) > 1
+
+
+def compile_options(rule):
+    """(include type mask, exclude type mask, third-party, popup-only) of a rule, or None if unrestricted"""
+    include = exclude = 0
+    third_party, popup = None, False
+    for option, value in rule['options'].items():
+        if option in TYPE_BITS:
+            if value is True:
+                include |= TYPE_BITS[option]
+            elif value is False:
+                exclude |= TYPE_BITS[option]
+        elif option == 'third-party':
+            third_party = value
+        elif option == 'popup':
+            popup = value is True
+    if not (include or exclude or popup) and third_party is None:
+        return None
+    return include, exclude, third_party, popup
+
+
+class SequentialPattern:
+    """Backtracking-free evaluation of a 'a.*b.*c' pattern: each piece is searched after the previous one.
+
+    Equivalent to the single regex for the fixed-width pieces ELParser generates, but linear
+    in the URL length instead of polynomial in the number of wildcards.
+    """
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.pieces = [re.compile(piece, flags) for piece in split_wildcards(pattern) if piece]
+
+    def search(self, url):
+        match, position = None, 0
+        for piece in self.pieces:
+            match = piece.search(url, position)
+            if not match:
+                return None
+            position = match.end()
+        return match or re.match("", url)
+
+
+class ProfiledPattern:
+    """Wraps a compiled rule pattern to record its cumulative evaluation time and hit count"""
+
+    def __init__(self, compiled, rule_id, stats, lock):
+        self.compiled = compiled
+        self.rule_id = rule_id
+        self.stats = stats
+        self.lock = lock
+
+    def search(self, url):
+        started = time.perf_counter()
+        match = self.compiled.search(url)
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            entry = self.stats.setdefault(self.rule_id, [0.0, 0, 0])
+            entry[0] += elapsed
+            entry[1] += 1
+            entry[2] += match is not None
+        return match
+
+
+def compile_rule(rule):
+    """Compile a rule's pattern, guarding against catastrophic backtracking.
+
+    Returns (compiled, quarantined): wildcard-heavy generated patterns are evaluated
+    piecewise instead, and pathological /regex/ rules are quarantined (never evaluated).
+    """
+    pattern = rule.get('pattern')
+    if not pattern:
+        return None, False
+    # Rules match case-insensitively; lower-case patterns already do against RequestContext.url_lower.
+    flags = re.IGNORECASE if pattern != pattern.lower() and 'match-case' not in rule['options'] else 0
+    if not is_pathological(pattern):
+        return re.compile(pattern, flags), False
+    if not is_regex_rule(rule) and not NESTED_QUANTIFIER.search(pattern):
+        return SequentialPattern(pattern, flags), False
+    logging.warning(f"Quarantined rule {rule['id']} prone to catastrophic backtracking: {rule['raw']}")
+    return None, True
+
+
+class RuleChecker:
+    """Compiled blocking and exception rules of one list, shared by ADChecker and TrackingChecker.
+
+    With profile=True every pattern records its evaluation time and hits, see profile_report().
+    """
+
+    def __init__(self, parser=None, json_file=None, profile=False):
         self.parser = parser if parser else ELParser()
         if json_file:
             self.parser.load_from_json(json_file)
 
+        self.profile = profile
+        self.rule_stats = {}
+        self.quarantined = []
+        self._stats_lock = Lock()
         self._prepare_matchers()
         self._eh_cache = {}
+        self.rules_evaluated = 0
 
     def _prepare_matchers(self):
         """Pre-compile all regex patterns and organize rules"""
@@ -19,217 +156,101 @@ class ADChecker:
             'element_hiding': []
         }
 
+        self._rules_by_id = {}
+        self._filters = {}
+        self._match_case = set()
         for category in self._compiled_rules:
             for rule in self.parser.rules[category]:
-                compiled = re.compile(rule['pattern']) if rule.get('pattern') else None
+                compiled, quarantined = compile_rule(rule)
+                if quarantined:
+                    self.quarantined.append(rule)
+                    continue
+                if compiled and self.profile:
+                    compiled = ProfiledPattern(compiled, rule['id'], self.rule_stats, self._stats_lock)
+                self._rules_by_id[rule['id']] = rule
+                if option_filter := compile_options(rule):
+                    self._filters[rule['id']] = option_filter
+                if 'match-case' in rule['options']:
+                    self._match_case.add(rule['id'])
                 self._compiled_rules[category].append((compiled, rule))
 
-    def should_block(self, url, options=None):
-        """Optimized single URL check"""
-        options = options or {}
-        domain = options.get('domain') if isinstance(options, dict) else None
+    def _match(self, url, options=None):
+        """(matched, rule_id) of the first blocking rule that applies, unless an exception rule does.
+
+        Given a RequestContext instead of a URL, $domain= rules are checked against the
+        page's host and type, third-party and popup options are enforced. Patterns run
+        against the lower-cased URL, except $match-case ones, which see it as requested.
+        """
+        context = url if isinstance(url, RequestContext) else None
+        if context:
+            url, exact_url, domain = context.url_lower, context.url, context.page_host
+        else:
+            options = options or {}
+            exact_url, domain = url, options.get('domain') if isinstance(options, dict) else None
+        checked = 0
 
         for compiled, rule in self._compiled_rules['exceptions']:
-            if self._check_domains_fast(domain, rule):
-                if compiled and compiled.search(url):
+            checked += 1
+            if self._check_domains_fast(domain, rule) and (context is None or self._options_match(context, rule)):
+                if compiled and compiled.search(exact_url if rule['id'] in self._match_case else url):
+                    self._add_evaluated(checked)
                     return False, None
 
         for compiled, rule in self._compiled_rules['blocking']:
-            if self._check_domains_fast(domain, rule):
-                if compiled and compiled.search(url):
+            checked += 1
+            if self._check_domains_fast(domain, rule) and (context is None or self._options_match(context, rule)):
+                if compiled and compiled.search(exact_url if rule['id'] in self._match_case else url):
+                    self._add_evaluated(checked)
                     return True, rule['id']
 
+        self._add_evaluated(checked)
         return False, None
 
-    def get_element_hiding_selectors(self, domain=None):
-        """Get element hiding selectors for a domain"""
-        selectors = []
-
-        for rule in self.parser.rules['element_hiding']:
-            if self._check_domain_restrictions(domain, rule):
-                selectors.append(rule['raw'].split('##')[1])
-
-        return selectors
-
-    def _matches_any(self, url, rules, options):
-        """Check if URL matches any of the given rules"""
-        for rule in rules:
-            if self._matches_rule(url, rule, options):
-                print(f"Matched rule: {rule['raw']}")
-                return True, rule['id']
-        return False, None
-
-    def _matches_rule(self, url, rule, options):
-        domain = None
-        if isinstance(options, list):
-            option_list = options
-        elif isinstance(options, dict):
-            domain = options.get("domain")
-            option_list = [opt for opt in options if opt != "domain"]
-        else:
-            option_list = []
-
-        if rule['options']:
-            # print(rule['options'])
-            # if not any(opt in option_list and val is True for opt, val in rule['options'].items()):
-            #     return False
-            if any(opt in option_list and val is False for opt, val in rule['options'].items()):
-                return False
-        # print(option_list)
-        if not self._check_domain_restrictions(domain, rule):
-            return False
-
-        if 'compiled_re' in rule:
-            # print(rule['compiled_re'])
-            if bool(re.compile(rule['pattern']).search(url)):
-                return True
-        return False
-
-    def _check_domain_restrictions(self, domain, rule):
-        """Check if domain matches rule's restrictions"""
-        include_domains = rule['domains']['include']
-        exclude_domains = rule['domains']['exclude']
-
-        if not include_domains and not exclude_domains:
+    def _options_match(self, context, rule):
+        """Whether the rule's type, third-party and popup options allow this request"""
+        option_filter = self._filters.get(rule['id'])
+        if option_filter is None:
             return True
-
-        domain_variants = self._get_domain_variants(domain)
-
-        for variant in domain_variants:
-            if variant in exclude_domains:
-                return False
-
-        if include_domains:
-            for variant in domain_variants:
-                if variant in include_domains:
-                    return True
+        include, exclude, third_party, popup = option_filter
+        if include and not context.type_mask & include:
             return False
-
-        return True
-
-    @lru_cache(maxsize=1024)
-    def _get_domain_variants(self, domain):
-        """Cached domain variants generation"""
-        if not domain:
-            return tuple()
-        parts = domain.split('.')
-        return tuple('.'.join(parts[i:]) for i in range(len(parts)))
-
-    def _check_domains_fast(self, domain, rule):
-        """Optimized domain checking"""
-        variants = self._get_domain_variants(domain)
-        include, exclude = rule['domains']['include'], rule['domains']['exclude']
-
-        if exclude and any(v in exclude for v in variants):
+        if context.type_mask & exclude:
             return False
-        if include and not any(v in include for v in variants):
+        if third_party is not None and context.third_party != third_party:
             return False
-        return True
-
-class TrackingChecker:
-    def __init__(self, parser=None, json_file=None):
-        self.parser = parser if parser else ELParser()
-        if json_file:
-            self.parser.load_from_json(json_file)
-
-        self._prepare_matchers()
-        self._eh_cache = {}
-
-    def _prepare_matchers(self):
-        """Pre-compile all regex patterns and organize rules"""
-        self._compiled_rules = {
-            'blocking': [],
-            'exceptions': [],
-            'element_hiding': []
+        return not popup or context.is_popup
+
+    def _add_evaluated(self, count):
+        """Accumulate the number of rules evaluated (checks may run from several threads)"""
+        with self._stats_lock:
+            self.rules_evaluated += count
+
+    def profile_report(self, top_n=PROFILE_TOP_N):
+        """Most expensive rules by cumulative evaluation time, never-matched and quarantined rules"""
+        with self._stats_lock:
+            stats = {rule_id: list(entry) for rule_id, entry in self.rule_stats.items()}
+
+        def describe(rule_id):
+            seconds, evaluations, hits = stats.get(rule_id, [0.0, 0, 0])
+            return {'id': rule_id, 'raw': self._rules_by_id[rule_id]['raw'], 'seconds': round(seconds, 6),
+                    'evaluations': evaluations, 'hits': hits}
+
+        expensive = sorted(stats, key=lambda rule_id: stats[rule_id][0], reverse=True)[:top_n]
+        return {
+            'most_expensive': [describe(rule_id) for rule_id in expensive],
+            'never_matched': [describe(rule_id) for rule_id in sorted(stats) if not stats[rule_id][2]],
+            'quarantined': [{'id': rule['id'], 'raw': rule['raw']} for rule in self.quarantined],
         }
 
-        for category in self._compiled_rules:
-            for rule in self.parser.rules[category]:
-                compiled = re.compile(rule['pattern']) if rule.get('pattern') else None
-                self._compiled_rules[category].append((compiled, rule))
-
-    def is_tracker(self, url, options=None):
-        """Optimized single URL check"""
-        options = options or {}
-        domain = options.get('domain') if isinstance(options, dict) else None
-
-        for compiled, rule in self._compiled_rules['exceptions']:
-            if self._check_domains_fast(domain, rule):
-                if compiled and compiled.search(url):
-                    return False, None
-
-        for compiled, rule in self._compiled_rules['blocking']:
-            if self._check_domains_fast(domain, rule):
-                if compiled and compiled.search(url):
-                    return True, rule['id']
-
-        return False, None
+    def dump_profile(self, filename, top_n=PROFILE_TOP_N):
+        """Write profile_report() to a JSON file"""
+        with open(filename, 'w') as f:
+            json.dump(self.profile_report(top_n), f, indent=2)
 
     def get_element_hiding_selectors(self, domain=None):
-        """Get element hiding selectors for a domain"""
-        selectors = []
-
-        for rule in self.parser.rules['element_hiding']:
-            if self._check_domain_restrictions(domain, rule):
-                selectors.append(rule['raw'].split('##')[1])
-
-        return selectors
-
-    def _matches_any(self, url, rules, options):
-        """Check if URL matches any of the given rules"""
-        for rule in rules:
-            if self._matches_rule(url, rule, options):
-                print(f"Matched rule: {rule['raw']}")
-                return True, rule['id']
-        return False, None
-
-    def _matches_rule(self, url, rule, options):
-        domain = None
-        if isinstance(options, list):
-            option_list = options
-        elif isinstance(options, dict):
-            domain = options.get("domain")
-            option_list = [opt for opt in options if opt != "domain"]
-        else:
-            option_list = []
-
-        if rule['options']:
-            # print(rule['options'])
-            # if not any(opt in option_list and val is True for opt, val in rule['options'].items()):
-            #     return False
-            if any(opt in option_list and val is False for opt, val in rule['options'].items()):
-                return False
-        # print(option_list)
-        if not self._check_domain_restrictions(domain, rule):
-            return False
-
-        if 'compiled_re' in rule:
-            # print(rule['compiled_re'])
-            if bool(re.compile(rule['pattern']).search(url)):
-                return True
-        return False
-
-    def _check_domain_restrictions(self, domain, rule):
-        """Check if domain matches rule's restrictions"""
-        include_domains = rule['domains']['include']
-        exclude_domains = rule['domains']['exclude']
-
-        if not include_domains and not exclude_domains:
-            return True
-
-        domain_variants = self._get_domain_variants(domain)
-
-        for variant in domain_variants:
-            if variant in exclude_domains:
-                return False
-
-        if include_domains:
-            for variant in domain_variants:
-                if variant in include_domains:
-                    return True
-            return False
-
-        return True
+        """Element hiding selectors that apply on a domain"""
+        return [rule['raw'].split('##')[1] for rule in self.parser.rules['element_hiding']
+                if self._check_domains_fast(domain, rule)]
 
     @lru_cache(maxsize=1024)
     def _get_domain_variants(self, domain):
@@ -249,3 +270,51 @@ class TrackingChecker:
         if include and not any(v in include for v in variants):
             return False
         return True
+
+
+class ADChecker(RuleChecker):
+    def should_block(self, url, options=None):
+        """Optimized single URL check; url may be a RequestContext (see RuleChecker._match)"""
+        return self._match(url, options)
+
+
+class TrackingChecker(RuleChecker):
+    def is_tracker(self, url, options=None):
+        """Optimized single URL check; url may be a RequestContext (see RuleChecker._match)"""
+        return self._match(url, options)
+
+
+class RuleSet:
+    """EasyPrivacy and EasyList checkers loaded together, classifying requests with the crawler's precedence.
+
+    Verdicts are memoized per RequestContext, which includes the page's host, so a
+    cached verdict is only reused when the same request recurs within one site
+    (repeated loads, popups, replays of its stored requests).
+    """
+
+    def __init__(self, easyprivacy=EASYPRIVACY_RULES, easylist=EASYLIST_RULES, cache_size=200_000):
+        self._setup(TrackingChecker(json_file=easyprivacy), ADChecker(json_file=easylist),
+                    ruleset_version(easyprivacy, easylist), cache_size)
+
+    @classmethod
+    def from_checkers(cls, tracker_checker, ad_checker, version='', cache_size=200_000):
+        """RuleSet over checkers built elsewhere, e.g. from lists parsed in memory by the benchmarks"""
+        rules = cls.__new__(cls)
+        rules._setup(tracker_checker, ad_checker, version, cache_size)
+        return rules
+
+    def _setup(self, tracker_checker, ad_checker, version, cache_size):
+        self.version = version
+        self.tracker_checker = tracker_checker
+        self.ad_checker = ad_checker
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, context):
+        """(decision, rule_id) of one request: trackers take precedence over ads"""
+        is_tracker, tracker_rule = self.tracker_checker.is_tracker(context)
+        if is_tracker:
+            return "TRACKER", tracker_rule
+        is_ad, ad_rule = self.ad_checker.should_block(context)
+        if is_ad:
+            return "AD", ad_rule
+        return "SAFE", None
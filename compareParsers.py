@@ -1,20 +1,46 @@
+import argparse
+import concurrent.futures
 import json
-from checker import ADChecker
+import os
+import random
+import zlib
+
+from checker import ADChecker, RuleSet, TrackingChecker
 from adblockparser import AdblockRule
+from request_context import REQUEST_TYPES, RequestContext
+from rules_parser import ELParser
+from settings import EASYLIST_RULES
+
+
+def easylist_ruleset(rules_file, profile=False):
+    """RuleSet over one EasyList-style list; adblockparser only gets that list, so no tracker rules take part"""
+    no_trackers = ELParser()
+    no_trackers.parse_rules([])
+    return RuleSet.from_checkers(TrackingChecker(parser=no_trackers), ADChecker(json_file=rules_file, profile=profile))
+
+
+def adblock_options(context):
+    """adblockparser options describing the same request: its type, third-party flag and page host"""
+    options = {request_type: request_type == context.resource_type for request_type in REQUEST_TYPES}
+    options["third-party"] = context.third_party
+    if context.page_host:
+        options["domain"] = context.page_host
+    return options
 
 
 class AdTester:
-    def __init__(self, rules_file="data/rules_lists/parsed_rules/EasyList.json"):
-        self.verifier = ADChecker(json_file=rules_file)
+    def __init__(self, rules_file="data/rules_lists/parsed_rules/EasyList.json", profile=False):
+        self.rules = easylist_ruleset(rules_file, profile)
+        self.verifier = self.rules.ad_checker
         self.adblock_rules = self._load_rules(rules_file)
 
     @staticmethod
-    def _load_rules(rules_file):
+    def _load_rules(rules_file, category="blocking"):
         with open(rules_file, "r", encoding="utf-8") as f:
             rules_json = json.load(f)
 
         rules = []
-        for rule in rules_json.get("blocking", []):
+        for rule in rules_json.get(category, []):
             if raw_rule := rule.get("raw"):
                 try:
                     rules.append(AdblockRule(raw_rule))
@@ -23,19 +49,168 @@ class AdTester:
                     continue
         return rules
 
-    def test_url(self, url, asset_type=None):
-        options = []
-        for _type in asset_type:
-            if _type == "type":
-                options.append(asset_type[_type])
-            else:
-                options.append(_type) if asset_type[_type] else None
-        my_parser, my_rule_id = (self.verifier.should_block
-                                 (url, [option.lower() for option in options] if options else []))
-        options = {option.lower(): True for option in options}
+    def test_url(self, url, resource_type="other", page_url=None):
+        context = RequestContext.build(url, resource_type, page_url)
+        decision, my_rule_id = self.rules.classify(context)
+        options = adblock_options(context)
         other_parser = any(
             rule.match_url(url, options)
             for rule in self.adblock_rules
             if rule.matching_supported(options)
         )
-        return my_parser, other_parser, my_rule_id if my_rule_id else -1
\ No newline at end of file
+        return decision == "AD", other_parser, my_rule_id if my_rule_id else -1
+
+
+_engines = {}
+
+
+def _load_engines(rules_file):
+    """Process-pool initializer: both engines are built once per worker"""
+    _engines["ours"] = easylist_ruleset(rules_file)
+    _engines["exceptions"] = AdTester._load_rules(rules_file, "exceptions")
+    _engines["blocking"] = AdTester._load_rules(rules_file, "blocking")
+
+
+def _adblockparser_verdict(url, options):
+    """(blocked, raw rule) from adblockparser, honouring exception rules like our engine does"""
+    for category, blocked in (("exceptions", False), ("blocking", True)):
+        for rule in _engines[category]:
+            if rule.matching_supported(options) and rule.match_url(url, options):
+                return blocked, rule.raw_rule_text
+    return False, None
+
+
+def _compare_chunk(chunk):
+    """Run both engines over (url, type, page_url) requests; returns the disagreements"""
+    disagreements = []
+    for url, resource_type, page_url in chunk:
+        context = RequestContext.build(url, resource_type, page_url)
+        decision, rule_id = _engines["ours"].classify(context)
+        ours = decision == "AD"
+        theirs, raw = _adblockparser_verdict(url, adblock_options(context))
+        if ours != theirs:
+            disagreements.append({
+                "url": url,
+                "type": context.resource_type,
+                "page": page_url,
+                "third_party": context.third_party,
+                "blocked_by": "ours" if ours else "adblockparser",
+                "rule_id": rule_id,
+                "adblockparser_rule": raw,
+            })
+    return len(chunk), disagreements
+
+
+class DifferentialTester:
+    """Offline differential testing of our matcher against adblockparser.
+
+    adblockparser is slow and only ever served as a cross-check, so it runs here,
+    sharded across processes, instead of on every crawled asset. Disagreements are
+    grouped by the rule that fired on either side.
+    """
+
+    def __init__(self, rules_file=EASYLIST_RULES, workers=None, chunk_size=500):
+        self.rules_file = rules_file
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        with open(rules_file, "r", encoding="utf-8") as f:
+            rules_json = json.load(f)
+        self.rules = {rule["id"]: rule["raw"] for category in ("blocking", "exceptions")
+                      for rule in rules_json.get(category, [])}
+
+    @staticmethod
+    def load_url_file(path, page_url=None):
+        """Read 'url[:::type[:::request_id]]' lines, e.g. a list of captured asset URLs, made from page_url"""
+        corpus = []
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                parts = line.strip().split(":::")
+                resource_type = parts[1].lower() if len(parts) > 1 else "other"
+                corpus.append((parts[0], resource_type, page_url))
+        return corpus
+
+    @staticmethod
+    def load_run(db, run_id):
+        """Requests stored for a crawl run, each with its site's crawl URL as the page"""
+        from sqlalchemy import select
+        from crawlerdb import CrawlJob, NetworkRequest
+
+        stmt = (select(NetworkRequest.url, NetworkRequest.resource_type, CrawlJob.url)
+                .outerjoin(CrawlJob, CrawlJob.website_id == NetworkRequest.website_id)
+                .where(NetworkRequest.run_id == run_id))
+        with db.engine.connect() as connection:
+            return [(url, resource_type.lower(), page_url) for url, resource_type, page_url in connection.execute(stmt)]
+
+    @staticmethod
+    def select(corpus, sample=None, shard=None, seed=1):
+        """Keep one shard ('i/n', by URL hash) of the corpus and then a random sample of it"""
+        if shard:
+            index, count = (int(part) for part in shard.split("/"))
+            corpus = [item for item in corpus if zlib.crc32(item[0].encode()) % count == index]
+        if sample and sample < len(corpus):
+            corpus = random.Random(seed).sample(corpus, sample)
+        return corpus
+
+    def run(self, corpus):
+        """Compare both engines on the corpus; returns the disagreement report"""
+        chunks = [corpus[start:start + self.chunk_size] for start in range(0, len(corpus), self.chunk_size)]
+        compared, disagreements = 0, []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_load_engines,
+                                                    initargs=(self.rules_file,)) as executor:
+            for count, found in executor.map(_compare_chunk, chunks):
+                compared += count
+                disagreements.extend(found)
+        return self.report(compared, disagreements)
+
+    def report(self, compared, disagreements, samples=5):
+        groups = {}
+        for disagreement in disagreements:
+            if disagreement["blocked_by"] == "ours":
+                key = ("ours", self.rules.get(disagreement["rule_id"], str(disagreement["rule_id"])))
+            else:
+                key = ("adblockparser", disagreement["adblockparser_rule"])
+            group = groups.setdefault(key, {"blocked_by": key[0], "rule": key[1], "count": 0, "examples": []})
+            group["count"] += 1
+            if len(group["examples"]) < samples:
+                group["examples"].append(disagreement["url"])
+        return {
+            "compared": compared,
+            "disagreements": len(disagreements),
+            "rules": sorted(groups.values(), key=lambda group: group["count"], reverse=True),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Differential test of our matcher against adblockparser")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--run", type=int, help="stored requests of a crawl run")
+    source.add_argument("--recorded", action="store_true", help="requests in the crawl artifact bundles")
+    source.add_argument("--urls", help="file of 'url[:::type]' lines")
+    parser.add_argument("--page", help="page URL the --urls requests were made from (third-party, $domain=)")
+    parser.add_argument("--rules", default=EASYLIST_RULES)
+    parser.add_argument("--sample", type=int, help="compare a random sample of this many requests")
+    parser.add_argument("--shard", help="only compare shard i of n, e.g. 0/4")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--output", default="data/differential_report.json")
+    args = parser.parse_args()
+
+    if args.run is not None:
+        from crawlerdb import crawler2db
+        db = crawler2db()
+        corpus = DifferentialTester.load_run(db, args.run)
+        db.close()
+    elif args.recorded:
+        from benchmark import recorded_corpus
+        corpus = recorded_corpus()
+    else:
+        corpus = DifferentialTester.load_url_file(args.urls, args.page)
+
+    tester = DifferentialTester(args.rules, args.workers)
+    result = tester.run(DifferentialTester.select(corpus, args.sample, args.shard))
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"{result['disagreements']} disagreements in {result['compared']} requests; report in {args.output}")
+    for group in result["rules"][:10]:
+        print(f"{group['count']:>8}  {group['blocked_by']:<14} {group['rule']}")
@@ -3,12 +3,15 @@ import hashlib
 import json
 import logging
 import os
+import socket
+import time
 from time import sleep
 from typing import Optional
 from urllib.parse import urlparse
 from tqdm import tqdm
 import concurrent.futures
-from threading import Lock
+from contextlib import contextmanager
+from threading import Event, Thread
 
 import requests
 from selenium import webdriver
@@ -20,24 +23,131 @@ from selenium.webdriver.support.wait import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support import expected_conditions as EC
 
-from checker import TrackingChecker
-from compareParsers import AdTester
-from crawlerdb import crawler2db, Website
-from settings import COOKIES_BUTTON_SELECTORS
+from artifacts import ArtifactBundle
+from checker import RuleChecker, RuleSet
+from crawlerdb import crawler2db
+from dbwriter import DBWriter
+from matcher_service import MatcherClient
+from metrics import CrawlMetrics, MetricsServer
+from request_blocker import RequestBlocker
+from request_context import RequestContext
+from scheduler import SiteBudget
+from settings import (COOKIES_BUTTON_SELECTORS, CRAWL_STAGES, JOB_HEARTBEAT_SECONDS, JOB_LEASE_SECONDS, SITE_TIME_BUDGET, MIN_PAGE_LOAD_TIMEOUT,
+                      MAX_PAGE_LOAD_TIMEOUT, LOAD_TIMEOUT_FACTOR, TIMEOUT_DEMOTION_THRESHOLD, BLOCK_MODES,
+                      COMPARE_STAGE_SHARE, STAGE_BUDGET_SHARES)
+
+
+class LeaseHeartbeat(Thread):
+    """Background thread that keeps a claimed crawl job's lease alive."""
+
+    def __init__(self, db: crawler2db, website_id: int, worker_id: str) -> None:
+        super().__init__(daemon=True)
+        self.db = db
+        self.website_id = website_id
+        self.worker_id = worker_id
+        self._stop_event = Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                if not self.db.heartbeat(self.website_id, self.worker_id, JOB_LEASE_SECONDS):
+                    logging.warning(f"Lost lease on website {self.website_id}")
+                    return
+            except Exception as e:
+                logging.error(f"Heartbeat failed for website {self.website_id}: {str(e)}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
 
 
 class Crawler:
     """Web crawler for analyzing website ads and tracking elements."""
 
-    def __init__(self, websites_path: str, analysis_type: str = None,max_retries: int = 3) -> None:
-        """Initialize crawler with list of websites to analyze."""
+    def __init__(self, websites_path: str, analysis_type: str = None, max_retries: int = 3,
+                 worker_id: Optional[str] = None, run_id: Optional[int] = None,
+                 matcher_url: Optional[str] = None,
+                 rules: Optional[RuleSet | concurrent.futures.Future] = None,
+                 metrics_port: Optional[int] = None, block_mode: Optional[str] = None) -> None:
+        """Initialize crawler with list of websites to analyze.
+
+        With a matcher service URL (or MATCHER_URL in the environment) assets are
+        classified by the shared matcher service instead of rule lists loaded here.
+        rules may be a future that is still compiling; the crawl only waits for it
+        when the first site reaches analysis. With a metrics port (or METRICS_PORT)
+        live crawl metrics are served at http://127.0.0.1:<port>/metrics.
+
+        block_mode "block" loads pages with AD/TRACKER requests failed inline (faster,
+        first-party data only); "compare" keeps the normal crawl and adds a stage that
+        loads each site unblocked and blocked, recording both in load_comparisons.
+        """
+        if block_mode not in (None, *BLOCK_MODES):
+            raise ValueError(f"Unknown block mode {block_mode!r}")
+        self.block_mode = block_mode
         self.analysis_type = analysis_type
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
         self.websites = websites_path
-        self.tracker_checker = TrackingChecker(json_file="data/rules_lists/parsed_rules/EasyPrivacy.json")
+        matcher_url = matcher_url or os.getenv("MATCHER_URL")
+        self.matcher = MatcherClient(matcher_url) if matcher_url else None
+        self._rules = None if self.matcher else rules if rules is not None else RuleSet()
         self.driver = self._initialize_webdriver()
         self.max_retries = max_retries
         self.db = crawler2db()
+        self.writer = DBWriter()
+        self.writer.start()
+        self.selector_hits = None
+        self.consent_selectors = {}
+        self.budget = self._new_budget()
+        self.metrics = CrawlMetrics()
+        self.run_id = run_id
+        self.bundles = {}
+        self.in_flight = 0
+        # Rule set the current site's verdicts were written under, once its analysis ran.
+        self.site_ruleset = None
         self.logger = logging.getLogger(__name__)
+        metrics_port = metrics_port or os.getenv("METRICS_PORT")
+        self.metrics_server = self._start_metrics_server(int(metrics_port)) if metrics_port else None
+
+    @property
+    def rules(self) -> Optional[RuleSet]:
+        return self._resolve_rules()
+
+    def _resolve_rules(self) -> Optional[RuleSet]:
+        """Wait for the rules prepared alongside the crawl; re-raises the exception if their preparation failed"""
+        if isinstance(self._rules, concurrent.futures.Future):
+            with self.metrics.timer("rules_wait_seconds"):
+                self._rules = self._rules.result()
+        return self._rules
+
+    @property
+    def ruleset(self) -> Optional[str]:
+        return self.rules.version if self.rules else None
+
+    def _start_metrics_server(self, port: int) -> MetricsServer:
+        server = MetricsServer(self.metrics, port=port)
+        server.add_gauge("crawler_in_flight_sites", lambda: self.in_flight, f'{{worker="{self.worker_id}"}}')
+        server.add_gauge("crawler_writer_queue_depth", lambda: self.writer.stats()["queue_depth"])
+        server.add_gauge("crawler_writer_avg_write_seconds", lambda: self.writer.stats()["avg_write_seconds"])
+        server.add_gauge("crawler_verdict_cache_hit_ratio", self._verdict_cache_hit_ratio)
+        return server.start()
+
+    def _verdict_cache_hit_ratio(self) -> Optional[float]:
+        """Hit ratio of the local verdict cache; None while rules are compiling or with the matcher service"""
+        if not isinstance(self._rules, RuleSet):
+            return None
+        info = self._rules.classify.cache_info()
+        return round(info.hits / (info.hits + info.misses), 4) if info.hits + info.misses else None
+
+    def _new_budget(self) -> SiteBudget:
+        if self.block_mode == "compare":
+            return SiteBudget(SITE_TIME_BUDGET, {**STAGE_BUDGET_SHARES, "compare": COMPARE_STAGE_SHARE})
+        return SiteBudget(SITE_TIME_BUDGET)
+
+    def _bundle(self, run_id: int) -> ArtifactBundle:
+        """This process's artifact shard for a run"""
+        if run_id not in self.bundles:
+            self.bundles[run_id] = ArtifactBundle(run_id, self.worker_id)
+        return self.bundles[run_id]
 
     @staticmethod
     def _initialize_webdriver() -> webdriver.Chrome:
@@ -53,7 +163,7 @@ class Crawler:
         chrome_options.add_argument("--lang=en")
 
         chrome_options.set_capability("timeouts", {
-            "pageLoad": 120000,
+            "pageLoad": MAX_PAGE_LOAD_TIMEOUT * 1000,
             "script": 30000
         })
 
@@ -75,105 +185,149 @@ class Crawler:
             options=chrome_options
         )
 
-        driver.set_page_load_timeout(120)
+        driver.set_page_load_timeout(MAX_PAGE_LOAD_TIMEOUT)
         driver.set_script_timeout(30)
 
         return driver
 
-    def accept_cookies(self) -> bool:
-        """Attempt to accept cookies using predefined selectors."""
+    def accept_cookies(self, domain: Optional[str] = None) -> bool:
+        """Attempt to accept cookies, trying the domain's remembered selector first."""
+        strategy = self.db.get_consent_strategy(domain) if domain else None
+        if strategy and strategy.selector_by:
+            remembered = {"by": strategy.selector_by, "value": strategy.selector_value}
+            if self._click_consent_selector(remembered, timeout=min(10, self.budget.remaining())):
+                self._remember_consent(domain, remembered)
+                return True
+
+        selectors = self._ranked_cookie_selectors()
         try:
-            WebDriverWait(self.driver, 20).until(
+            WebDriverWait(self.driver, min(20, self.budget.remaining())).until(
                 EC.any_of(
                     *[EC.presence_of_element_located((selector["by"], selector["value"]))
-                      for selector in COOKIES_BUTTON_SELECTORS]
+                      for selector in selectors]
                 )
             )
             self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
 
-            for selector in COOKIES_BUTTON_SELECTORS:
-                try:
-                    button = self.driver.find_element(selector["by"], selector["value"])
-                    if button.is_displayed():
-                        button.click()
-                        return True
-                except NoSuchElementException:
-                    continue
+            for selector in selectors:
+                if self._click_consent_selector(selector):
+                    self._remember_consent(domain, selector)
+                    return True
             return False
         except TimeoutException:
+            if self.budget.expired():
+                self.budget.mark_timed_out()
             return False
 
-    def get_all_cookies(self, url: str, wait_time: int = 0) -> None:
-        """Capture and categorize cookies from target URL."""
+    def _click_consent_selector(self, selector: dict, timeout: int = 0) -> bool:
+        """Click a consent button if it is present and displayed."""
+        try:
+            if timeout:
+                WebDriverWait(self.driver, timeout).until(
+                    EC.presence_of_element_located((selector["by"], selector["value"]))
+                )
+            button = self.driver.find_element(selector["by"], selector["value"])
+            if button.is_displayed():
+                button.click()
+                return True
+        except (NoSuchElementException, TimeoutException):
+            pass
+        return False
+
+    def _ranked_cookie_selectors(self) -> list[dict]:
+        """Order COOKIES_BUTTON_SELECTORS by how often each one succeeded across the corpus."""
+        if self.selector_hits is None:
+            self.selector_hits = self.db.get_selector_hits()
+        return sorted(
+            COOKIES_BUTTON_SELECTORS,
+            key=lambda selector: -self.selector_hits.get((selector["by"], selector["value"]), 0)
+        )
+
+    def _remember_consent(self, domain: Optional[str], selector: dict) -> None:
+        """Persist the successful selector for the domain and bump its global hit count."""
+        key = (selector["by"], selector["value"])
+        if self.selector_hits is not None:
+            self.selector_hits[key] = self.selector_hits.get(key, 0) + 1
+        self.db.record_selector_hit(selector)
+        if domain:
+            self.consent_selectors[domain] = selector
+
+    def get_all_cookies(self, url: str, run_id: int, wait_time: int = 0, website_id: Optional[int] = None) -> None:
+        """Capture cookies with a single CDP call, classify each once and bulk-upsert them."""
         driver = self.driver
-        cookies = {"first_party": [], "third_party": []}
 
         driver.execute_cdp_cmd("Network.enable", {})
-        driver.get(url)
+        driver.set_page_load_timeout(max(1, int(self.budget.remaining())))
+        try:
+            driver.get(url)
+        except TimeoutException:
+            self.budget.mark_timed_out()
+            driver.execute_script("window.stop();")
 
         domain = urlparse(url).netloc
-        allowed_domains = [f'.{domain}', f'.www.{domain}', f'www.{domain}']
-
-        sleep(wait_time)
-        raw_cookies = driver.execute_cdp_cmd('Network.getAllCookies', {})
-        website_id = self.db.add_website(domain=domain)
-
-        for cookie in raw_cookies['cookies']:
-            if ('sameSite' in cookie and
-                    cookie['sameSite'] == 'None' and
-                    cookie['domain'] not in allowed_domains):
-                cookies['third_party'].append(cookie)
-                self.db.store_cookies(
-                    website_id=website_id,
-                    cookies=cookies['third_party'],
-                    party='third'
-                )
-            else:
-                cookies['first_party'].append(cookie)
-                self.db.store_cookies(
-                    website_id=website_id,
-                    cookies=cookies['first_party'],
-                    party='first'
-                )
+        allowed_domains = {f'.{domain}', f'.www.{domain}', f'www.{domain}'}
 
-        print(f"Cookies saved successfully for \"{domain}\".")
+        sleep(min(wait_time, self.budget.remaining()))
+        raw_cookies = driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies']
+        if website_id is None:
+            website_id = self.db.add_website(domain=domain)
+        self.metrics.count("cookies", len(raw_cookies))
 
-    def get_logs(self, url: str,  website_id: int) -> None:
-        """Capture and save network performance logs."""
-        domain = urlparse(url).netloc.replace("www.", "").replace(".", "_")
+        for cookie in raw_cookies:
+            cookie['party'] = self._classify_cookie(cookie, allowed_domains)
+
+        with self.metrics.timer("db_seconds"):
+            written = self.db.add_cookies_bulk(website_id, raw_cookies, run_id=run_id)
+        self.metrics.count("db_rows", written)
+
+        print(f"{written} cookies saved successfully for \"{domain}\".")
+
+    @staticmethod
+    def _classify_cookie(cookie: dict, allowed_domains: set) -> str:
+        """Cross-site (SameSite=None) cookies set for a foreign domain are third-party."""
+        if cookie.get('sameSite') == 'None' and cookie['domain'] not in allowed_domains:
+            return 'third'
+        return 'first'
+
+    def get_logs(self, url: str, website_id: int, run_id: int) -> None:
+        """Capture and save network performance logs, handing the parsed entries to the DB writer."""
         logs = self.driver.get_log("performance")
         data = []
 
         for log in [json.loads(entry["message"])["message"] for entry in logs if entry]:
             if log["method"] == "Network.requestWillBeSent":
                 data.append(log)
-                self.db.add_request(
-                    website_id=website_id,
-                    request_id=log["params"]["requestId"],
-                    url=log["params"]["request"]["url"],
-                    method=log["params"]["request"]["method"],
-                    resource_type=log["params"]["type"],
-                    timestamp=datetime.datetime.fromtimestamp(
+                self.metrics.count("requests")
+                self.writer.submit("request", {
+                    "run_id": run_id,
+                    "website_id": website_id,
+                    "request_id": log["params"]["requestId"],
+                    "url": log["params"]["request"]["url"],
+                    "method": log["params"]["request"]["method"],
+                    "resource_type": log["params"]["type"],
+                    "timestamp": datetime.datetime.fromtimestamp(
                         log["params"].get("wallTime", 0),
                         datetime.timezone.utc
                     ),
-                )
+                })
             elif log["method"] == "Network.responseReceived":
                 data.append(log)
-                self.db.add_response(
-                    request_id=log["params"]["requestId"],
-                    status_code=log["params"]["response"]["status"],
-                    headers=log["params"]["response"]["headers"],
-                    security_state=log["params"]["response"].get("securityState", "insecure"),
-                    timestamp=datetime.datetime.fromtimestamp(
+                self.metrics.count("responses")
+                self.writer.submit("response", {
+                    "run_id": run_id,
+                    "website_id": website_id,
+                    "response_id": log["params"]["requestId"],
+                    "status_code": log["params"]["response"]["status"],
+                    "headers": log["params"]["response"]["headers"],
+                    "security_state": log["params"]["response"].get("securityState", "insecure"),
+                    "timestamp": datetime.datetime.fromtimestamp(
                         log["params"]["response"].get("responseTime", 0) / 1000,
                         datetime.timezone.utc
                     ),
-                )
+                })
 
-        os.makedirs(f"data/websites_data/{domain}", exist_ok=True)
-        with open(f"data/websites_data/{domain}/network_log.json", "w") as f:
-            json.dump(data, f, indent=2)
+        self.metrics.count("db_rows", len(data))
+        self._bundle(run_id).write(website_id, "network_log", data)
         print(f"{len(data)} logs saved successfully.")
 
     def handle_popups(self, timeout: int = 5) -> bool:
@@ -205,8 +359,11 @@ class Crawler:
             'div[role="dialog"]'
         ]
         for selector in modal_selectors:
+            if timeout and self.budget.expired():
+                self.budget.mark_timed_out()
+                break
             try:
-                modal = WebDriverWait(self.driver, timeout).until(
+                modal = WebDriverWait(self.driver, min(timeout, self.budget.remaining())).until(
                     EC.visibility_of_element_located((By.CSS_SELECTOR, selector))
                 )
                 self.driver.execute_script("arguments[0].remove()", modal)
@@ -228,27 +385,20 @@ class Crawler:
 
     @staticmethod
     def is_third_party(request_url: str, page_url: str) -> bool:
-        """Check if a request URL is a third-party request relative to a page URL."""
+        """Check if a request URL is a third-party request relative to a page URL (by registrable domain)."""
+        return RequestContext.build(request_url, page_url=page_url).third_party
 
-        def get_origin(url: str) -> str:
-            """Extract the origin (scheme + netloc) from a URL."""
-            parsed = urlparse(url)
-            return f"{parsed.scheme}://{parsed.netloc}"
-
-        return get_origin(request_url) != get_origin(page_url)
-
-    def media_downloader(self, url: str, website_id: int) -> None:
+    def media_downloader(self, url: str, website_id: int, run_id: int) -> None:
         """Download media assets with proper response_id handling"""
         domain = urlparse(url).netloc.replace("www.", "").replace(".", "_")
-        log_path = f"data/websites_data/{domain}/network_log.json"
+        bundle = self._bundle(run_id)
+        logs = list(bundle.read(website_id, "network_log"))
 
-        if not os.path.exists(log_path):
-            logging.warning(f"No network logs found at {log_path}")
+        if not logs:
+            logging.warning(f"No network logs stored for {url}")
             return
 
-        with open(log_path, "r") as f:
-            logs = json.load(f)
-
+        assets, failed = [], []
         for entry in logs:
             if entry["method"] != "Network.responseReceived":
                 continue
@@ -258,15 +408,19 @@ class Crawler:
             request_id = entry["params"]["requestId"]
             response_id = request_id
 
-            with open(f"data/websites_data/{domain}/Successful_urls.txt", "a+") as f:
-                f.write(f"{asset_url}:::{asset_type}:::{request_id}\n")
+            assets.append({"url": asset_url, "type": asset_type, "request_id": request_id})
 
             if asset_type not in ['image', 'media'] or asset_url.startswith(("blob", "data")):
                 continue
 
+            if self.budget.expired():
+                self.budget.mark_timed_out()
+                continue
+
             try:
-                response = requests.get(asset_url, stream=True, timeout=10)
-                response.raise_for_status()
+                with self.metrics.timer("download_seconds"):
+                    response = requests.get(asset_url, stream=True, timeout=min(10, max(1, self.budget.remaining())))
+                    response.raise_for_status()
 
                 save_dir = f"data/websites_data/{domain}/responseReceived/{asset_type}s"
                 os.makedirs(save_dir, exist_ok=True)
@@ -276,22 +430,29 @@ class Crawler:
                     filename = f"asset_{hash(asset_url)}"
 
                 file_path = os.path.join(save_dir, filename)
-                with open(file_path, "wb") as f:
+                with self.metrics.timer("download_seconds"), open(file_path, "wb") as f:
                     for chunk in response.iter_content(1024):
                         f.write(chunk)
-
-                self.db.add_downloaded_file(
-                    website_id=website_id,
-                    request_id=request_id,
-                    response_id=response_id,
-                    file_type=asset_type,
-                    file_path=file_path
-                )
+                        self.metrics.count("bytes_downloaded", len(chunk))
+                self.metrics.count("files_downloaded")
+
+                with self.metrics.timer("db_seconds"):
+                    self.writer.submit("downloaded_file", {
+                        "run_id": run_id,
+                        "website_id": website_id,
+                        "request_id": request_id,
+                        "response_id": response_id,
+                        "file_type": asset_type,
+                        "file_path": file_path
+                    })
+                self.metrics.count("db_rows")
 
             except Exception as e:
                 logging.error(f"Failed to download {asset_url} - {e}")
-                with open(f"data/websites_data/{domain}/Failed_urls.txt", "a") as f:
-                    f.write(f"{asset_url}\n")
+                failed.append({"url": asset_url})
+
+        bundle.write(website_id, "assets", assets)
+        bundle.write(website_id, "failed_downloads", failed)
 
     @staticmethod
     def read_urls_from_file(file_path: str) -> list[str]:
@@ -300,102 +461,257 @@ class Crawler:
             return [line.strip() for line in f if line.strip()]
 
     def start_crawling(self) -> None:
-        """Execute full crawling workflow with enhanced error handling and retries."""
+        """Execute a resumable crawl: enqueue the site list, then lease pending/failed sites from the shared queue."""
         logging.info("================ Crawler Started ================")
-        urls = self.read_urls_from_file(self.websites)
+        owns_run = self.run_id is None
+        if owns_run:
+            self.run_id = self.db.start_run(self.worker_id)
+        self._enqueue_websites()
+
+        while job := self._claim_next_website():
+            url, website_id, site_run_id = job.url, job.website_id, job.run_id
+            heartbeat = LeaseHeartbeat(self.db, website_id, self.worker_id)
+            heartbeat.start()
+            self.budget = self._new_budget()
+            self.site_ruleset = None
+            self.metrics.start_site(website_id, url)
+            self.in_flight = 1
+            try:
+                load_timeout = self._adaptive_load_timeout(job)
+                self._process_website(url, website_id, site_run_id, job.stage, job.is_popup, load_timeout)
+
+            except WebDriverException as e:
+                logging.error(f"WebDriver error (attempt {job.attempts}/{self.max_retries}) for {url}: {str(e)}")
+                if isinstance(e, TimeoutException):
+                    self.budget.mark_timed_out()
+                self._mark_website_failed(website_id)
+                sleep(5)
 
-        for url in urls:
-            url, category = url.split(" ::: ")
+            except Exception as e:
+                logging.error(f"Unexpected error processing {url}: {str(e)}")
+                self._mark_website_failed(website_id)
+
+            finally:
+                if self.driver:
+                    try:
+                        self.driver.quit()
+                    except Exception as e:
+                        logging.error(f"Error quitting driver: {str(e)}")
+                    self.driver = None
+
+                self.in_flight = 0
+                heartbeat.stop()
+                self.db.release_job(website_id, self.worker_id)
+                logging.info(f"Finished processing {url} (attempt {job.attempts})")
+
+        self.writer.close()
+        for bundle in self.bundles.values():
+            bundle.close()
+        if owns_run:
+            self.db.finish_run(self.run_id)
+        self.db.close()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if os.path.exists(self.metrics.path):
+            CrawlMetrics.print_summary(self.metrics.path)
+        logging.info("================ Crawler Finished ================")
+
+    def _claim_next_website(self):
+        """Lease the next site; raises instead if rule preparation running alongside the crawl failed"""
+        if isinstance(self._rules, concurrent.futures.Future) and self._rules.done():
+            self._resolve_rules()
+        return self.db.claim_next_website(self.max_retries, self.worker_id, JOB_LEASE_SECONDS, self.run_id)
+
+    def _enqueue_websites(self) -> None:
+        """Load the websites file into the DB as pending sites in one bulk operation."""
+        entries = []
+        for line in self.read_urls_from_file(self.websites):
+            url, category = line.split(" ::: ")
             if not self._validate_url(url):
                 logging.warning(f"Skipping invalid URL: {url}")
                 continue
+            entries.append((url, category))
 
-            domain = urlparse(url).netloc
-            website_id = None
-            attempts = 0
-            success = False
-
-            while attempts < self.max_retries and not success:
-                attempts += 1
-                try:
-                    website_id = self._get_or_create_website(domain, category)
-                    if not website_id:
-                        continue
-
-                    self._process_website(url, website_id)
-                    success = True
-
-                except WebDriverException as e:
-                    logging.error(f"WebDriver error (attempt {attempts}/{self.max_retries}) for {url}: {str(e)}")
-                    if attempts == self.max_retries:
-                        self._mark_website_failed(website_id)
-                    sleep(5)
-
-                except Exception as e:
-                    logging.error(f"Unexpected error processing {url}: {str(e)}")
-                    self._mark_website_failed(website_id)
-                    break
-
-                finally:
-                    if self.driver:
-                        try:
-                            self.driver.quit()
-                        except Exception as e:
-                            logging.error(f"Error quitting driver: {str(e)}")
-
-                    logging.info(f"Finished processing {url} (attempt {attempts})")
-            self.db.close()
-        logging.info("================ Crawler Finished ================")
+        if entries:
+            self.db.enqueue_websites(entries)
+        logging.info(f"Enqueued {len(entries)} websites")
 
-    def _process_website(self, url: str, website_id: int) -> None:
-        """Process a single website with all crawling steps."""
-        self.driver = self._initialize_webdriver()
-        print(f"Processing {url}")
-        self.driver.get(url)
-        sleep(5)
+    def _process_website(self, url: str, website_id: int, run_id: int, resume_stage: Optional[str] = None,
+                         is_popup: bool = False, load_timeout: float = MAX_PAGE_LOAD_TIMEOUT) -> None:
+        """Process a single website, skipping stages already checkpointed by a previous attempt.
 
+        Every stage runs against self.budget; a stage that runs out of time keeps
+        whatever it collected and the crawl moves on to the next stage.
+        """
+        done = CRAWL_STAGES[:CRAWL_STAGES.index(resume_stage) + 1] if resume_stage in CRAWL_STAGES else []
         domain_safe = urlparse(url).netloc.replace("www.", "").replace(".", "_")
-        os.makedirs(f"data/websites_data/{domain_safe}", exist_ok=True)
-        self.driver.save_screenshot(f"data/websites_data/{domain_safe}/screenshot.png")
-
-        is_popup = self.handle_popups()
-        self.accept_cookies()
-
-        self.get_logs(url, website_id)
-        self.media_downloader(url, website_id)
-        self.get_all_cookies(url, 20)
-        self._analyze_assets_for_ads_and_trackers(domain_safe, url, is_popup)
-
-        self._mark_website_completed(website_id)
-
-    def _get_or_create_website(self, domain: str, category: str) -> Optional[int]:
-        """Get existing website ID or create new entry"""
+        if done:
+            print(f"Resuming {url} after stage \"{done[-1]}\"")
+
+        if "logs" not in done:
+            if self.driver is None:
+                with self.metrics.stage("browser"):
+                    self.driver = self._initialize_webdriver()
+                    self.metrics.count("browser_restarts")
+            print(f"Processing {url}")
+            with self._stage("load"):
+                self._load_page(url, website_id, load_timeout, run_id)
+                sleep(min(5, self.budget.remaining()))
+
+                os.makedirs(f"data/websites_data/{domain_safe}", exist_ok=True)
+                self.driver.save_screenshot(f"data/websites_data/{domain_safe}/screenshot.png")
+
+            with self._stage("consent"):
+                domain = urlparse(url).netloc
+                strategy = self.db.get_consent_strategy(domain)
+                if strategy and not strategy.needs_popup_handling:
+                    is_popup = self.handle_popups(timeout=0)
+                else:
+                    is_popup = self.handle_popups()
+                self.accept_cookies(domain)
+                # Only a selector clicked on this visit is kept; a remembered one that failed is cleared.
+                self.db.save_consent_strategy(domain, self.consent_selectors.pop(domain, None), is_popup)
+
+            with self._stage("capture"):
+                self._flush_writes()
+                self.db.clear_site_capture(run_id, website_id)
+                self.get_logs(url, website_id, run_id)
+                self._flush_writes()
+                self.db.save_checkpoint(website_id, "logs", is_popup)
+
+        if "media" not in done:
+            with self._stage("download"):
+                self.media_downloader(url, website_id, run_id)
+                self._flush_writes()
+                self.db.save_checkpoint(website_id, "media")
+
+        if "cookies" not in done:
+            if self.driver is None:
+                with self.metrics.stage("browser"):
+                    self.driver = self._initialize_webdriver()
+                    self.metrics.count("browser_restarts")
+            with self._stage("cookies"):
+                self.get_all_cookies(url, run_id, 20, website_id)
+                self._flush_writes()
+                self.db.save_checkpoint(website_id, "cookies")
+
+        if "analysis" not in done:
+            with self._stage("analysis"):
+                self._analyze_assets_for_ads_and_trackers(domain_safe, url, is_popup, website_id, run_id)
+                self._flush_writes()
+                self.db.save_checkpoint(website_id, "analysis")
+
+        if self.block_mode == "compare":
+            if self.driver is None:
+                with self.metrics.stage("browser"):
+                    self.driver = self._initialize_webdriver()
+                    self.metrics.count("browser_restarts")
+            with self._stage("compare"):
+                self._compare_loads(url, website_id, run_id)
+
+        with self.metrics.stage("finalize"):
+            self._mark_website_completed(website_id, run_id)
+
+    def _flush_writes(self) -> None:
+        """Wait for the DB writer to commit everything queued so far, so a checkpoint is durable."""
+        with self.metrics.timer("db_seconds"):
+            self.writer.flush()
+        stats = self.writer.stats()
+        self.metrics.gauge("writer_queue_depth", stats["queue_depth"])
+        self.metrics.gauge("writer_avg_write_seconds", stats["avg_write_seconds"])
+
+    @contextmanager
+    def _stage(self, name: str):
+        """Run a crawl stage against its share of the site budget while recording its metrics."""
+        self.budget.start_stage(name)
+        with self.metrics.stage(name):
+            yield
+
+    def _load_page(self, url: str, website_id: int, load_timeout: float, run_id: Optional[int] = None) -> None:
+        """Load the page within the load stage's time; on timeout keep what has rendered so far."""
+        timeout = min(load_timeout, self.budget.remaining())
+        self.driver.set_page_load_timeout(max(1, int(timeout)))
+        started = time.monotonic()
         try:
-            return self.db.add_website(domain=domain, category=category)
-        except Exception as e:
-            logging.error(f"Database error for {domain}: {e}")
-            return None
-
-    def _mark_website_completed(self, website_id: int) -> None:
-        """Update website status to complete."""
+            if self.block_mode == "block":
+                timed_out = self._blocked_load(url, website_id, run_id, "blocked")["timed_out"]
+            else:
+                self.driver.get(url)
+                timed_out = False
+        except TimeoutException:
+            self.driver.execute_script("window.stop();")
+            timed_out = True
+        if timed_out:
+            logging.warning(f"Page load of {url} exceeded {int(timeout)}s, continuing with partial page")
+            self.budget.mark_timed_out()
+        else:
+            self.db.record_load_time(website_id, time.monotonic() - started)
+
+    def _inline_verdict(self, request_url: str, resource_type: str, page_url: str) -> tuple:
+        """(decision, rule_id) for a request paused by Chrome; local rules answer from the verdict cache"""
+        if self.matcher:
+            result = self.matcher.classify(page_url, False, [(request_url, resource_type)])["results"][0]
+            return result["decision"], result["rule_id"]
+        return self.rules.classify(RequestContext.build(request_url, resource_type, page_url))
+
+    def _blocked_load(self, url: str, website_id: int, run_id: int, mode: str) -> dict:
+        """Load url through request interception ('blocked' fails AD/TRACKER requests) and record the load"""
+        blocker = RequestBlocker(self.driver, lambda request_url, resource_type:
+                                 self._inline_verdict(request_url, resource_type, url),
+                                 verdict_blocks=self.matcher is not None)
+        stats = blocker.load(url, block=mode == "blocked")
+        self.metrics.count("inline_verdict_seconds", stats["verdict_seconds"])
+        self.metrics.count("blocked_requests", stats["blocked_requests"])
+        self.db.save_load_comparison(run_id, website_id, mode, stats)
+        return stats
+
+    def _compare_loads(self, url: str, website_id: int, run_id: int) -> None:
+        """Load the page unblocked, then blocked, so the load_cost report can show what ads and trackers cost."""
+        for mode in ("unblocked", "blocked"):
+            if self.budget.expired():
+                self.budget.mark_timed_out()
+                return
+            timeout = min(MAX_PAGE_LOAD_TIMEOUT, self.budget.remaining() / (2 if mode == "unblocked" else 1))
+            self.driver.set_page_load_timeout(max(1, int(timeout)))
+            stats = self._blocked_load(url, website_id, run_id, mode)
+            if stats["timed_out"]:
+                self.budget.mark_timed_out()
+            print(f"{mode} load of {url}: {stats.get('load_event_ms')} ms, {stats['transferred_bytes']} bytes, "
+                  f"{stats['requests']} requests ({stats['blocked_requests']} blocked)")
+
+    def _adaptive_load_timeout(self, job) -> float:
+        """Derive a page-load timeout from the domain's, or else its category's, observed load times."""
+        observed = job.load_seconds or self.db.category_load_seconds(job.website.category)
+        if observed is None:
+            return MAX_PAGE_LOAD_TIMEOUT
+        return min(MAX_PAGE_LOAD_TIMEOUT, max(MIN_PAGE_LOAD_TIMEOUT, observed * LOAD_TIMEOUT_FACTOR))
+
+    def _mark_website_completed(self, website_id: int, run_id: Optional[int] = None) -> None:
+        """Update website status to complete and refresh its precomputed stats."""
+        self.metrics.increment("sites_completed")
         try:
-            website = self.db.session.query(Website).get(website_id)
-            if website:
-                website.visited_status = "completed"
-                self.db.session.commit()
+            self._record_site_timeouts(website_id)
+            self.db.set_website_status(website_id, "completed", run_id, self.site_ruleset)
         except Exception as e:
             logging.error(f"Error marking website completed: {str(e)}")
 
     def _mark_website_failed(self, website_id: int) -> None:
         """Update website status to failed."""
+        self.metrics.increment("sites_failed")
         try:
-            website = self.db.session.query(Website).get(website_id)
-            if website:
-                website.visited_status = "failed"
-                self.db.session.commit()
+            self._record_site_timeouts(website_id)
+            self.db.set_website_status(website_id, "failed")
         except Exception as e:
             logging.error(f"Error marking website failed: {str(e)}")
 
+    def _record_site_timeouts(self, website_id: int) -> None:
+        """Flag partial results and demote repeatedly timing-out sites before the visit outcome is stored.
+
+        Only failed sites are claimed again, so the demotion has to be in place by the
+        time a failed site goes back into the queue.
+        """
+        self.db.record_site_timeouts(website_id, self.budget.timed_out, TIMEOUT_DEMOTION_THRESHOLD)
+
     @staticmethod
     def _validate_url(url: str) -> bool:
         """Validate URL format."""
@@ -407,25 +723,28 @@ class Crawler:
             return False
 
 
-    def _analyze_assets_for_ads_and_trackers(self, domain: str, url: str, is_popup: bool) -> None:
-        success_file = f"data/websites_data/{domain}/Successful_urls.txt"
-        if not os.path.exists(success_file):
+    def _analyze_assets_for_ads_and_trackers(self, domain: str, url: str, is_popup: bool,
+                                             website_id: int, run_id: int) -> None:
+        bundle = self._bundle(run_id)
+        assets = [(asset["url"], asset["type"], asset["request_id"]) for asset in bundle.read(website_id, "assets")]
+        if not assets:
             return
 
-        with open(success_file, "r") as f:
-            assets = [line.strip().split(':::') for line in f if line.strip()]
-
-        ads_results_path = f"data/websites_data/{domain}/ads_results.txt"
-        trackers_results_path = f"data/websites_data/{domain}/trackers_results.txt"
-        results_lock = Lock()
-        db_lock = Lock()
-        ad_tester = AdTester()
-        # domain_fn = domain.replace("www.", "").replace(".", "_")
-
-        def save_result(path, result, asset_url):
-            with results_lock:
-                with open(path, "a") as file:
-                    file.write(f"[{result}] {asset_url}\n")
+        # Buffered here and written as one bundle member per section once the analysis is done.
+        verdict_records, failed_ads = [], []
+        verdicts, ruleset = [None] * len(assets), self.ruleset
+        if self.matcher:
+            with self.metrics.timer("matcher_service_seconds"):
+                response = self.matcher.classify(url, is_popup, [(asset_url, asset_type)
+                                                                 for asset_url, asset_type, _ in assets])
+            verdicts = [(result["decision"], result["rule_id"]) for result in response["results"]]
+            ruleset = response["ruleset"]
+            self.metrics.count("matcher_latency_ms", response["latency_ms"])
+        else:
+            rules_evaluated = self.rules.tracker_checker.rules_evaluated + self.rules.ad_checker.rules_evaluated
+            cache_hits = self._domain_cache_hits()
+        self.site_ruleset = ruleset
+        self.db.record_run_ruleset(run_id, ruleset)
 
         def save_ad_resource(asset_url, max_retries=3):
             try:
@@ -455,53 +774,39 @@ class Crawler:
 
             except Exception as e:
                 logging.warning(f"Failed to save AD resource {asset_url}: {str(e)}")
-                os.makedirs(f"data/websites_data/{domain}", exist_ok=True)
-                with open(f"data/websites_data/{domain}/Failed_ADs.txt", "a") as f:
-                    f.write(f"{asset_url}\n")
+                failed_ads.append({"url": asset_url})
                 return False
 
         def update_db(request_id, rule_id, decision):
-            with db_lock:
-                self.db.add_analysis_result(
-                    request_id=request_id,
-                    rule_id=rule_id,
-                    decision=decision
-                )
-
-        def analyze_tracker(asset_url, asset_type, is_popup, url):
-            is_third_party = self.is_third_party(asset_url, url)
-            test_params = {
-                "type": asset_type.lower(),
-                "popup": is_popup,
-                "third-party": is_third_party
-            }
-            is_tracker = self.tracker_checker.is_tracker(asset_url, test_params)
-            tracker_result = "TRACKER" if is_tracker[0] else "NOT TRACKER"
-            return is_tracker, tracker_result, test_params
-
-        def analyze_ad(asset_url, test_params, ad_tester):
-            is_ad = ad_tester.test_url(asset_url, test_params)
-            ad_result = "AD" if is_ad[0] or is_ad[1] else "NOT AD"
-            return is_ad, ad_result
-
-        def process_asset(asset, pbar):
+            with self.metrics.timer("db_seconds"):
+                self.writer.submit("analysis_result", {
+                    "run_id": run_id,
+                    "website_id": website_id,
+                    "request_id": request_id,
+                    "ruleset": ruleset,
+                    "rule_id": rule_id,
+                    "decision": decision
+                })
+            self.metrics.count("db_rows")
+
+        def analyze(asset_url, asset_type):
+            with self.metrics.timer("match_seconds"):
+                return self.rules.classify(RequestContext.build(asset_url, asset_type, url, is_popup))
+
+        def process_asset(asset, verdict, pbar):
             asset_url, asset_type, request_id = asset
+            if self.budget.expired():
+                self.budget.mark_timed_out("analysis")
+                pbar.update(1)
+                return False
             try:
-                is_tracker, tracker_result, test_params = analyze_tracker(asset_url, asset_type, is_popup, url)
-                save_result(trackers_results_path, tracker_result, asset_url)
-
-                is_ad = (False, False, None)
-                ad_result = "NOT AD"
-                if not is_tracker[0]:
-                    is_ad, ad_result = analyze_ad(asset_url, test_params, ad_tester)
-                    save_result(ads_results_path, ad_result, asset_url)
-                    if ad_result == "AD" and asset_type in ["image", "media"]:
-                        save_ad_resource(asset_url)
-                else:
-                    save_result(ads_results_path, ad_result, asset_url)
+                decision, rule_id = verdict or analyze(asset_url, asset_type)
 
-                rule_id = is_ad[2] if not is_tracker[0] else is_tracker[1]
-                decision = self._determine_ad_decision(is_ad, is_tracker)
+                verdict_records.append({"url": asset_url, "type": asset_type, "request_id": request_id,
+                                        "decision": decision, "rule_id": rule_id})
+                if decision == "AD" and asset_type in ["image", "media"]:
+                    with self.metrics.timer("ad_download_seconds"):
+                        save_ad_resource(asset_url)
                 update_db(request_id, rule_id, decision)
 
                 if len(asset_url) > 30:
@@ -522,14 +827,18 @@ class Crawler:
                   unit="asset",
                   bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]") as pbar:
             with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                list(executor.map(lambda asset: process_asset(asset, pbar), assets))
+                list(executor.map(lambda asset, verdict: process_asset(asset, verdict, pbar), assets, verdicts))
 
+        bundle.write(website_id, "verdicts", verdict_records)
+        bundle.write(website_id, "failed_ads", failed_ads)
+        self.metrics.count("assets", len(assets))
+        self.metrics.count("urls_classified", len(assets))
+        if not self.matcher:
+            self.metrics.count("rules_evaluated", self.rules.tracker_checker.rules_evaluated
+                               + self.rules.ad_checker.rules_evaluated - rules_evaluated)
+            self.metrics.count("cache_hits", self._domain_cache_hits() - cache_hits)
 
     @staticmethod
-    def _determine_ad_decision(is_ad: tuple, is_tracker) -> str:
-        """Determine the final ad decision based on test results."""
-        if is_tracker[0]:
-            return "TRACKER"
-        elif is_ad[0] or is_ad[1]:
-            return "AD"
-        return "SAFE"
+    def _domain_cache_hits() -> int:
+        """Hits of the checkers' cached domain-variant lookups so far."""
+        return RuleChecker._get_domain_variants.cache_info().hits
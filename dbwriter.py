@@ -0,0 +1,146 @@
+import logging
+import time
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from typing import Any, NamedTuple, Optional
+
+from crawlerdb import crawler2db
+from settings import WRITER_BATCH_ROWS, WRITER_FLUSH_SECONDS, WRITER_QUEUE_SIZE
+
+
+class WriteRecord(NamedTuple):
+    kind: str
+    row: Any
+
+
+class DBWriter(Thread):
+    """Background thread that owns all bulk crawler2db writes.
+
+    Producers submit typed records to a bounded queue and block while it is full.
+    The writer groups queued rows into one transaction per batch, flushing when
+    WRITER_BATCH_ROWS rows are pending, every WRITER_FLUSH_SECONDS, on flush()
+    and on close().
+    """
+
+    # Foreign-key order: a batch always writes requests before the rows that reference them.
+    WRITE_ORDER = ("request", "response", "downloaded_file", "analysis_result")
+
+    def __init__(self, db: Optional[crawler2db] = None, max_queue: int = WRITER_QUEUE_SIZE,
+                 batch_size: int = WRITER_BATCH_ROWS, flush_interval: float = WRITER_FLUSH_SECONDS) -> None:
+        super().__init__(daemon=True, name="db-writer")
+        self.db = db or crawler2db()
+        self.queue = Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._writers = {
+            "request": self.db.add_requests_bulk,
+            "response": self.db.add_responses_bulk,
+            "downloaded_file": self.db.add_downloaded_files_bulk,
+            "analysis_result": self.db.add_analysis_results_bulk,
+        }
+        self._batches = {kind: [] for kind in self.WRITE_ORDER}
+        self._pending = 0
+        self._stats_lock = Lock()
+        self._stats = {
+            "batches": 0,
+            "rows_written": 0,
+            "rows_dropped": 0,
+            "write_seconds": 0.0,
+            "max_write_seconds": 0.0,
+            "blocked_seconds": 0.0,
+        }
+
+    def submit(self, kind: str, row: dict) -> None:
+        """Queue one row for writing, blocking while the queue is full (backpressure)."""
+        if kind not in self._writers:
+            raise ValueError(f"Unknown record kind: {kind}")
+        record = WriteRecord(kind, row)
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            started = time.perf_counter()
+            self.queue.put(record)
+            with self._stats_lock:
+                self._stats["blocked_seconds"] += time.perf_counter() - started
+
+    def flush(self) -> None:
+        """Block until every record submitted so far has been committed."""
+        done = Event()
+        self.queue.put(WriteRecord("flush", done))
+        done.wait()
+
+    def close(self) -> None:
+        """Flush the remaining records and stop the writer thread."""
+        self.queue.put(WriteRecord("stop", None))
+        self.join()
+        self.db.close()
+        logging.info(f"DB writer stopped: {self.stats()}")
+
+    def stats(self) -> dict:
+        """Queue depth, throughput and write latency so far."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self.queue.qsize()
+        stats["avg_write_seconds"] = stats["write_seconds"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def run(self) -> None:
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except Empty:
+                record = None
+
+            if record is not None and record.kind == "stop":
+                self._write_batches()
+                self.db.release_session()
+                return
+            if record is not None and record.kind == "flush":
+                self._write_batches()
+                record.row.set()
+                continue
+            if record is not None:
+                self._batches[record.kind].append(record.row)
+                self._pending += 1
+
+            if self._pending >= self.batch_size or time.monotonic() >= deadline:
+                self._write_batches()
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write_batches(self) -> None:
+        """Write every pending batch in foreign-key order and commit them together.
+
+        Each kind is written under its own SAVEPOINT, so a kind that fails is rolled
+        back on its own and the rows of the other kinds still commit.
+        """
+        if not self._pending:
+            return
+
+        started = time.perf_counter()
+        written = 0
+        for kind in self.WRITE_ORDER:
+            if not self._batches[kind]:
+                continue
+            try:
+                with self.db.session.begin_nested():
+                    written += self._writers[kind](self._batches[kind], commit=False)
+            except Exception as e:
+                logging.error(f"DB writer failed to write {len(self._batches[kind])} {kind} rows: {e}")
+        try:
+            self.db.session.commit()
+        except Exception as e:
+            self.db.session.rollback()
+            logging.error(f"DB writer failed to commit {self._pending} rows: {e}")
+            written = 0
+        elapsed = time.perf_counter() - started
+
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["rows_written"] += written
+            self._stats["rows_dropped"] += self._pending - written
+            self._stats["write_seconds"] += elapsed
+            self._stats["max_write_seconds"] = max(self._stats["max_write_seconds"], elapsed)
+
+        self._batches = {kind: [] for kind in self.WRITE_ORDER}
+        self._pending = 0
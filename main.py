@@ -1,21 +1,46 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
 import os
-from settings import ESSENTIAL_DIRS, RULES_LISTS
-from support import rule_list_downloader
-from rules_parser import ELParser
-from crawler import Crawler
+import sys
+import threading
+from settings import BLOCK_MODES, EASYLIST_RULES, EASYPRIVACY_RULES, ESSENTIAL_DIRS, REPORTS, RULES_LISTS
+
+# Selenium, SQLAlchemy, requests and friends are imported inside the commands that
+# need them, so that e.g. `main.py classify` starts without loading the crawler.
+
+MATCHER_BATCH_SIZE = 500
+PARSED_RULES_MANIFEST = os.path.join(ESSENTIAL_DIRS["parsed_rules"], "manifest.json")
 
 
 class WebAnalyzer:
     def __init__(self):
         self._initialize_project_structure()
-        self.parser = ELParser()
+        self._manifest_lock = threading.Lock()
 
     def run(self):
-        """Main execution flow"""
-        self._download_and_parse_rules()
-        self._crawl_websites()
+        """Main execution flow.
+
+        Rule lists are downloaded, parsed and compiled on a background thread while the
+        crawler starts its browser and loads the site queue; the crawl only waits for the
+        rules when the first site reaches analysis.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            rules = executor.submit(self.prepare_rules)
+            self.crawl(rules=rules)
         print("All tasks completed successfully!")
 
+    def prepare_rules(self, download=True):
+        """Download and parse every list concurrently, then compile them; returns the RuleSet"""
+        from checker import RuleSet
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(RULES_LISTS)) as executor:
+            parsed = sum(executor.map(lambda item: self._prepare_list(item[0], item[1]["url"] if download else None),
+                                      RULES_LISTS.items()))
+        print(f"Rule lists ready ({len(RULES_LISTS) - parsed} of {len(RULES_LISTS)} already up to date)")
+        return RuleSet(EASYPRIVACY_RULES, EASYLIST_RULES)
+
     @staticmethod
     def _initialize_project_structure():
         """Create all required directories"""
@@ -23,34 +48,201 @@ class WebAnalyzer:
             os.makedirs(dir_path, exist_ok=True)
         print("Project directories initialized")
 
-    def _download_and_parse_rules(self):
-        """Handle rule downloading and parsing"""
+    @staticmethod
+    def fetch_rules():
+        """Download the rule lists"""
+        from support import rule_list_downloader
+
         print("Downloading rule lists...")
         rule_list_downloader(RULES_LISTS)
 
+    def _prepare_list(self, rules_list, url=None):
+        if url:
+            from support import download_rule_list
+
+            download_rule_list(rules_list, url)
+        return self._parse_list(rules_list)
+
+    def parse_rules(self, force=False):
+        """Parse the downloaded rule lists into the JSON files the checkers load.
+
+        A list is only parsed again when its content or the parser changed since the
+        JSON was written; fingerprints are kept in the parsed rules manifest.
+        """
         print("Parsing rules...")
-        for rules_list in RULES_LISTS.keys():
-            rules_path = os.path.join("data", "rules_lists", "Lists", f"{rules_list}.txt")
-            with open(rules_path, "r", encoding="utf-8") as f:
-                rules = f.readlines()
-                self.parser.parse_rules(rules)
-                output_path = os.path.join(ESSENTIAL_DIRS["parsed_rules"], f"{rules_list}.json")
-                self.parser.save_to_json(output_path)
-        print(f"Processed {len(RULES_LISTS)} rules lists")
+        parsed = sum(self._parse_list(rules_list, force) for rules_list in RULES_LISTS.keys())
+        print(f"Processed {len(RULES_LISTS)} rules lists ({len(RULES_LISTS) - parsed} already up to date)")
+
+    @staticmethod
+    def _list_fingerprint(rules_path):
+        from rules_parser import parser_version
+
+        with open(rules_path, "rb") as f:
+            return {"source": hashlib.sha256(f.read()).hexdigest(), "parser": parser_version()}
+
+    def _parse_list(self, rules_list, force=False):
+        """Parse one list unless its JSON is current; returns whether it was parsed"""
+        from rules_parser import ELParser
+
+        rules_path = os.path.join(ESSENTIAL_DIRS["lists"], f"{rules_list}.txt")
+        output_path = os.path.join(ESSENTIAL_DIRS["parsed_rules"], f"{rules_list}.json")
+        fingerprint = self._list_fingerprint(rules_path)
+        with self._manifest_lock:
+            manifest = self._read_manifest()
+        if not force and manifest.get(rules_list) == fingerprint and os.path.exists(output_path):
+            return False
+
+        parser = ELParser()
+        with open(rules_path, "r", encoding="utf-8") as f:
+            parser.parse_rules(f.readlines())
+        parser.save_to_json(output_path)
+        with self._manifest_lock:
+            manifest = self._read_manifest()
+            manifest[rules_list] = fingerprint
+            with open(PARSED_RULES_MANIFEST, "w") as f:
+                json.dump(manifest, f, indent=2)
+        return True
 
     @staticmethod
-    def _crawl_websites():
+    def _read_manifest():
+        if not os.path.exists(PARSED_RULES_MANIFEST):
+            return {}
+        with open(PARSED_RULES_MANIFEST, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def crawl(websites_path=None, run_id=None, matcher_url=None, rules=None, metrics_port=None, block_mode=None):
         """Execute website crawling"""
+        from crawler import Crawler
+
         print("Starting website crawling...")
-        websites_path = os.path.join(ESSENTIAL_DIRS["websites"], "websites_categorized.txt")
-        crawler = Crawler(websites_path)
+        websites_path = websites_path or os.path.join(ESSENTIAL_DIRS["websites"], "websites_categorized.txt")
+        crawler = Crawler(websites_path, run_id=run_id, matcher_url=matcher_url, rules=rules,
+                          metrics_port=metrics_port, block_mode=block_mode)
         crawler.start_crawling()
 
 
+def _read_requests(lines, page_url=None):
+    """Parse 'url [type [page_url]]' lines into (url, type, page_url) tuples"""
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        yield parts[0], parts[1] if len(parts) > 1 else "other", parts[2] if len(parts) > 2 else page_url
+
+
+def classify(lines, out, page_url=None, is_popup=False, matcher_url=None,
+             easyprivacy=EASYPRIVACY_RULES, easylist=EASYLIST_RULES):
+    """Write 'decision<TAB>rule_id<TAB>url' for every request line.
+
+    With a matcher service URL the rule lists are not compiled here at all, which is
+    what keeps start-up fast; otherwise they are loaded once for the whole input.
+    """
+    requests = _read_requests(lines, page_url)
+    if matcher_url:
+        from matcher_service import MatcherClient
+
+        client = MatcherClient(matcher_url)
+        batch = []
+        for request in requests:
+            if batch and (request[2] != batch[0][2] or len(batch) >= MATCHER_BATCH_SIZE):
+                _classify_remote(client, batch, is_popup, out)
+                batch = []
+            batch.append(request)
+        if batch:
+            _classify_remote(client, batch, is_popup, out)
+        return
+
+    from checker import RuleSet
+    from request_context import RequestContext
+
+    rules = RuleSet(easyprivacy, easylist)
+    for url, resource_type, request_page in requests:
+        decision, rule_id = rules.classify(RequestContext.build(url, resource_type, request_page, is_popup))
+        out.write(f"{decision}\t{'' if rule_id is None else rule_id}\t{url}\n")
+
+
+def _classify_remote(client, batch, is_popup, out):
+    response = client.classify(batch[0][2] or "", is_popup, [(url, resource_type) for url, resource_type, _ in batch])
+    for (url, _, _), result in zip(batch, response["results"]):
+        rule_id = result["rule_id"]
+        out.write(f"{result['decision']}\t{'' if rule_id is None else rule_id}\t{url}\n")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Ad and tracker crawler")
+    commands = parser.add_subparsers(dest="command")
+
+    commands.add_parser("fetch-rules", help="download the rule lists")
+    parse_parser = commands.add_parser("parse", help="parse the downloaded rule lists")
+    parse_parser.add_argument("--force", action="store_true", help="parse lists even if their JSON is up to date")
+
+    classify_parser = commands.add_parser("classify", help="classify 'url [type [page_url]]' lines from stdin")
+    classify_parser.add_argument("--page", help="page URL for lines that do not give one (third-party, $domain=)")
+    classify_parser.add_argument("--popup", action="store_true", help="requests were made by a popup")
+    classify_parser.add_argument("--matcher", default=os.getenv("MATCHER_URL"),
+                                 help="matcher service URL (default: MATCHER_URL); skips compiling the rule lists")
+    classify_parser.add_argument("--easyprivacy", default=EASYPRIVACY_RULES)
+    classify_parser.add_argument("--easylist", default=EASYLIST_RULES)
+
+    crawl_parser = commands.add_parser("crawl", help="crawl the website list")
+    crawl_parser.add_argument("--websites", help="website list (default: data/websites/websites_categorized.txt)")
+    crawl_parser.add_argument("--run", type=int, dest="run_id", help="join an existing crawl run")
+    crawl_parser.add_argument("--matcher", help="matcher service URL")
+    crawl_parser.add_argument("--metrics-port", type=int,
+                              help="serve live Prometheus metrics on this port (default: METRICS_PORT, off if unset)")
+    crawl_parser.add_argument("--block-mode", choices=BLOCK_MODES,
+                              help="block: fail ad/tracker requests while loading; "
+                                   "compare: also record an unblocked and a blocked load of every site")
+
+    replay_parser = commands.add_parser("replay", help="re-classify a stored crawl run")
+    replay_parser.add_argument("--run", type=int, dest="run_id", required=True, help="crawl run to replay")
+    replay_parser.add_argument("--workers", type=int, help="classifier processes (default: one per CPU)")
+    replay_parser.add_argument("--chunk-size", type=int, default=5000)
+
+    report_parser = commands.add_parser("report", help="export a prevalence report as CSV or Parquet")
+    report_parser.add_argument("report", choices=REPORTS)
+    report_parser.add_argument("output", help="CSV path (add .gz for compressed output) or .parquet path")
+    report_parser.add_argument("--run", type=int, dest="run_id", help="restrict to one crawl run")
+    report_parser.add_argument("--ruleset", help="rule-list version for top_rules (default: each run's crawl-time one)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == "classify":
+        classify(sys.stdin, sys.stdout, args.page, args.popup, args.matcher, args.easyprivacy, args.easylist)
+    elif args.command == "replay":
+        from replay import Replayer
+
+        replayer = Replayer(workers=args.workers, chunk_size=args.chunk_size)
+        print(f"{replayer.replay(args.run_id)} verdicts written for run {args.run_id} (rule set {replayer.ruleset})")
+        replayer.db.close()
+    elif args.command == "report":
+        from reporting import Reporter
+
+        params = {"run_id": args.run_id}
+        if args.ruleset:
+            params["ruleset"] = args.ruleset
+        print(f"{Reporter().export(args.report, args.output, **params)} rows written to {args.output}")
+    else:
+        analyzer = WebAnalyzer()
+        if args.command == "fetch-rules":
+            analyzer.fetch_rules()
+        elif args.command == "parse":
+            analyzer.parse_rules(args.force)
+        elif args.command == "crawl":
+            analyzer.crawl(args.websites, args.run_id, args.matcher, metrics_port=args.metrics_port,
+                           block_mode=args.block_mode)
+        else:
+            analyzer.run()
+
+
 if __name__ == "__main__":
     try:
-        analyzer = WebAnalyzer()
-        analyzer.run()
+        main()
     except Exception as e:
         print(f"Error in main execution: {str(e)}")
         raise
@@ -0,0 +1,155 @@
+import argparse
+import json
+import logging
+import signal
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import requests
+
+from checker import RuleSet
+from metrics import CrawlMetrics
+from request_context import RequestContext
+from settings import EASYLIST_RULES, EASYPRIVACY_RULES, MATCHER_HOST, MATCHER_PORT
+
+
+class MatcherService:
+    """Holds one compiled rule set and classifies batches of page requests for every crawler process.
+
+    reload() compiles the new rule lists next to the live ones and swaps them in
+    with a single assignment, so requests keep being served during a reload and
+    a batch is always classified by one rule-set version.
+    """
+
+    def __init__(self, easyprivacy: str = EASYPRIVACY_RULES, easylist: str = EASYLIST_RULES) -> None:
+        self.rule_files = (easyprivacy, easylist)
+        self.rules = RuleSet(easyprivacy, easylist)
+        self._reload_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=10000)
+        self._stats = {"batches": 0, "urls": 0, "reloads": 0}
+
+    def reload(self) -> str:
+        """Load the rule lists again and switch to them; returns the new rule-set version"""
+        with self._reload_lock:
+            rules = RuleSet(*self.rule_files)
+            previous, self.rules = self.rules.version, rules
+        with self._stats_lock:
+            self._stats["reloads"] += 1
+        logging.info(f"Rule set reloaded: {previous} -> {rules.version}")
+        return rules.version
+
+    def classify(self, page_url: str, is_popup: bool, batch: list) -> dict:
+        """Classify [{url, type}, ...] requests of one page"""
+        started = time.perf_counter()
+        rules = self.rules
+        results = []
+        for request in batch:
+            decision, rule_id = rules.classify(RequestContext.build(request["url"], request.get("type", "other"),
+                                                                    page_url, is_popup))
+            results.append({"decision": decision, "rule_id": rule_id})
+        latency = time.perf_counter() - started
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["urls"] += len(batch)
+            self._latencies.append(latency)
+        return {"ruleset": rules.version, "results": results, "latency_ms": round(latency * 1000, 3)}
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+            latencies = list(self._latencies)
+        stats["ruleset"] = self.rules.version
+        stats["cache"] = self.rules.classify.cache_info()._asdict()
+        if latencies:
+            stats["p50_ms"] = round(CrawlMetrics._percentile(latencies, 50) * 1000, 3)
+            stats["p99_ms"] = round(CrawlMetrics._percentile(latencies, 99) * 1000, 3)
+        return stats
+
+    def serve(self, host: str = MATCHER_HOST, port: int = MATCHER_PORT) -> None:
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, body: dict) -> None:
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path == "/stats":
+                    self._reply(200, service.stats())
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    if self.path == "/classify":
+                        self._reply(200, service.classify(body["page_url"], body.get("is_popup", False),
+                                                          body["requests"]))
+                    elif self.path == "/reload":
+                        self._reply(200, {"ruleset": service.reload()})
+                    else:
+                        self._reply(404, {"error": "not found"})
+                except (KeyError, ValueError) as e:
+                    self._reply(400, {"error": str(e)})
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=self.reload, daemon=True).start())
+        logging.info(f"Matcher service on http://{host}:{port} with rule set {self.rules.version}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+class MatcherClient:
+    """Thin client for the matcher service: one HTTP round trip per page"""
+
+    def __init__(self, url: str, timeout: float = 60) -> None:
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def classify(self, page_url: str, is_popup: bool, batch: list[tuple]) -> dict:
+        """Classify (url, type) requests of a page; returns {ruleset, results, latency_ms}"""
+        response = self.session.post(f"{self.url}/classify", timeout=self.timeout, json={
+            "page_url": page_url,
+            "is_popup": is_popup,
+            "requests": [{"url": url, "type": resource_type} for url, resource_type in batch],
+        })
+        response.raise_for_status()
+        return response.json()
+
+    def reload(self) -> str:
+        response = self.session.post(f"{self.url}/reload", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["ruleset"]
+
+    def stats(self) -> dict:
+        response = self.session.get(f"{self.url}/stats", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve ad/tracker classification to crawler processes")
+    parser.add_argument("--host", default=MATCHER_HOST)
+    parser.add_argument("--port", type=int, default=MATCHER_PORT)
+    parser.add_argument("--easyprivacy", default=EASYPRIVACY_RULES)
+    parser.add_argument("--easylist", default=EASYLIST_RULES)
+    args = parser.parse_args()
+
+    MatcherService(args.easyprivacy, args.easylist).serve(args.host, args.port)
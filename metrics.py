@@ -0,0 +1,243 @@
+import json
+import logging
+import math
+import os
+import re
+import resource
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from typing import Callable, Optional
+
+from settings import METRICS_HOST, METRICS_PORT, METRICS_RATE_WINDOW
+
+# Counters whose recent rate is exported as well as their total.
+RATE_COUNTERS = ("sites_completed", "sites_failed", "urls_classified", "bytes_downloaded")
+
+
+class CrawlMetrics:
+    """Per-stage timings and counters for every crawled site, appended to one JSON Lines file per run.
+
+    Each line describes one stage of one site: wall time, CPU time, peak RSS and
+    whatever counters the stage reported (requests, assets, bytes downloaded,
+    rules evaluated, cache hits, DB rows written, seconds spent in sub-steps).
+    Levels sampled with gauge(), such as the writer queue depth, are kept apart
+    under "gauges" so that summaries never add them up.
+    """
+
+    def __init__(self, run_id: Optional[str] = None, directory: str = "data/metrics") -> None:
+        self.run_id = run_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"run_{self.run_id}.jsonl")
+        self._lock = Lock()
+        self._site = {}
+        self._counters = {}
+        self._gauges = {}
+        # Process-lifetime aggregates for the live endpoint; updated in O(1) next to the per-stage records.
+        self._totals = {}
+        self._stage_totals = {}
+        self._recent = {key: deque() for key in RATE_COUNTERS}
+
+    def start_site(self, website_id: int, url: str) -> None:
+        self._site = {"website_id": website_id, "url": url}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure one stage; counters added while it runs are attached to its record."""
+        with self._lock:
+            self._counters, self._gauges = {}, {}
+        started, cpu_started = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            record = {
+                "run_id": self.run_id,
+                **self._site,
+                "stage": name,
+                "wall_seconds": round(time.perf_counter() - started, 4),
+                "cpu_seconds": round(time.process_time() - cpu_started, 4),
+                "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
+            with self._lock:
+                record.update(self._counters)
+                if self._gauges:
+                    record["gauges"] = dict(self._gauges)
+                totals = self._stage_totals.setdefault(name, [0.0, 0])
+                totals[0] += record["wall_seconds"]
+                totals[1] += 1
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def count(self, key: str, amount: float = 1) -> None:
+        """Add to a counter of the current stage (safe to call from worker threads)."""
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._add_total(key, amount)
+
+    def gauge(self, key: str, value: float) -> None:
+        """Record the last value of a level (e.g. a queue depth) on the current stage; never added to the totals."""
+        with self._lock:
+            self._gauges[key] = value
+
+    def increment(self, key: str, amount: float = 1) -> None:
+        """Add to a process-wide counter only, for events outside any stage (e.g. a failed site)."""
+        with self._lock:
+            self._add_total(key, amount)
+
+    def _add_total(self, key: str, amount: float) -> None:
+        self._totals[key] = self._totals.get(key, 0) + amount
+        if key in self._recent:
+            # One bucket per second keeps the rate window cheap even for per-chunk byte counts.
+            buckets, second = self._recent[key], int(time.monotonic())
+            if buckets and buckets[-1][0] == second:
+                buckets[-1][1] += amount
+            else:
+                buckets.append([second, amount])
+                while buckets[0][0] <= second - METRICS_RATE_WINDOW:
+                    buckets.popleft()
+
+    def rate(self, key: str) -> float:
+        """Per-second rate of a RATE_COUNTERS counter over the last METRICS_RATE_WINDOW seconds."""
+        horizon = int(time.monotonic()) - METRICS_RATE_WINDOW
+        with self._lock:
+            return sum(amount for second, amount in self._recent[key] if second > horizon) / METRICS_RATE_WINDOW
+
+    def prometheus(self, gauges: Optional[dict] = None) -> str:
+        """Render totals, stage durations, rates and {name: (labels, callable)} gauges in Prometheus text format."""
+        lines = []
+        with self._lock:
+            totals = dict(self._totals)
+            stage_totals = {stage: list(values) for stage, values in self._stage_totals.items()}
+        for key, value in sorted(totals.items()):
+            name = f"crawler_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}_total"
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        lines.append("# TYPE crawler_stage_duration_seconds summary")
+        for stage, (total, count) in sorted(stage_totals.items()):
+            lines.append(f'crawler_stage_duration_seconds_sum{{stage="{stage}"}} {round(total, 4)}')
+            lines.append(f'crawler_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+        lines.append("# TYPE crawler_stage_duration_seconds_avg gauge")
+        for stage, (total, count) in sorted(stage_totals.items()):
+            lines.append(f'crawler_stage_duration_seconds_avg{{stage="{stage}"}} {round(total / count, 4)}')
+        for key in RATE_COUNTERS:
+            per_minute = key.startswith("sites_")
+            name = f"crawler_{key}_per_{'minute' if per_minute else 'second'}"
+            lines += [f"# TYPE {name} gauge", f"{name} {round(self.rate(key) * (60 if per_minute else 1), 4)}"]
+        for name, (labels, read) in sorted((gauges or {}).items()):
+            try:
+                value = read()
+            except Exception as e:
+                logging.debug(f"Metric {name} unavailable: {e}")
+                continue
+            if value is not None:
+                lines += [f"# TYPE {name} gauge", f"{name}{labels} {value}"]
+        return "\n".join(lines) + "\n"
+
+    @contextmanager
+    def timer(self, key: str):
+        """Accumulate the duration of a sub-step, e.g. DB writes, into a counter of the current stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(key, time.perf_counter() - started)
+
+    @staticmethod
+    def _percentile(values: list, pct: float) -> float:
+        ordered = sorted(values)
+        rank = math.ceil(pct / 100 * len(ordered))
+        return ordered[max(0, rank - 1)]
+
+    @classmethod
+    def summarize(cls, path: str) -> dict:
+        """Return {stage: {sites, p50, p95, total, <counter totals>, <gauge>_max}} for a metrics file."""
+        stages = {}
+        with open(path, "r") as f:
+            for line in f:
+                record = json.loads(line)
+                stages.setdefault(record["stage"], []).append(record)
+
+        summary = {}
+        for stage, records in stages.items():
+            durations = [record["wall_seconds"] for record in records]
+            totals, peaks = {}, {}
+            for record in records:
+                for key, value in record.items():
+                    if key in ("run_id", "website_id", "url", "stage", "max_rss_kb"):
+                        continue
+                    if isinstance(value, (int, float)):
+                        totals[key] = totals.get(key, 0) + value
+                for key, value in record.get("gauges", {}).items():
+                    peaks[f"{key}_max"] = max(peaks.get(f"{key}_max", value), value)
+            summary[stage] = {
+                "sites": len(records),
+                "p50": cls._percentile(durations, 50),
+                "p95": cls._percentile(durations, 95),
+                **totals,
+                **peaks,
+            }
+        return summary
+
+    @classmethod
+    def print_summary(cls, path: str) -> None:
+        summary = cls.summarize(path)
+        print(f"{'stage':<12}{'sites':>8}{'p50 (s)':>12}{'p95 (s)':>12}{'total (s)':>12}")
+        for stage, stats in summary.items():
+            print(f"{stage:<12}{stats['sites']:>8}{stats['p50']:>12.2f}{stats['p95']:>12.2f}"
+                  f"{stats['wall_seconds']:>12.1f}")
+
+
+class MetricsServer:
+    """Optional /metrics endpoint (Prometheus text format) for a long-running crawler process.
+
+    It only reads aggregates CrawlMetrics keeps anyway, so a scrape costs a few
+    dictionary copies and is safe to leave on in production.
+    """
+
+    def __init__(self, metrics: CrawlMetrics, gauges: Optional[dict] = None,
+                 host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+        self.metrics = metrics
+        self.gauges = gauges or {}
+        self.host, self.port = host, port
+        self.server = None
+
+    def add_gauge(self, name: str, read: Callable[[], Optional[float]], labels: str = "") -> None:
+        self.gauges[name] = (labels, read)
+
+    def start(self) -> "MetricsServer":
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = service.metrics.prometheus(service.gauges).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logging.info(f"Metrics on http://{self.host}:{self.server.server_port}/metrics")
+        return self
+
+    def stop(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+if __name__ == "__main__":
+    CrawlMetrics.print_summary(sys.argv[1])
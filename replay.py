@@ -0,0 +1,106 @@
+import concurrent.futures
+import logging
+import os
+import sys
+import time
+from typing import Optional
+
+from sqlalchemy import func, literal, select
+
+from checker import RuleSet
+from crawlerdb import CrawlJob, NetworkRequest, Website, crawler2db
+from request_context import RequestContext
+from rules_parser import ruleset_version
+from settings import EASYLIST_RULES, EASYPRIVACY_RULES
+
+_rules = {}
+
+
+def _load_rules(easyprivacy: str, easylist: str) -> None:
+    """Process-pool initializer: every worker compiles the rule lists once"""
+    _rules["current"] = RuleSet(easyprivacy, easylist)
+
+
+def _classify_chunk(rows: list) -> list:
+    """Classify a chunk of (website_id, request_id, url, resource_type, page_url, is_popup) rows"""
+    results = []
+    classify = _rules["current"].classify
+    for website_id, request_id, url, resource_type, page_url, is_popup in rows:
+        decision, rule_id = classify(RequestContext.build(url, resource_type, page_url, is_popup))
+        results.append((website_id, request_id, decision, rule_id))
+    return results
+
+
+class Replayer:
+    """Re-classifies the stored requests of a crawl run against the current rule lists, without a browser.
+
+    Requests are streamed out of network_requests in chunks and classified by a pool
+    of processes that each compile the rule lists once and memoize verdicts per request
+    context, which only pays off for requests repeated within a site. Verdicts are
+    written as a new set of analysis_results rows tagged with the rule-set fingerprint,
+    next to the ones produced at crawl time.
+    """
+
+    def __init__(self, db: Optional[crawler2db] = None, workers: Optional[int] = None, chunk_size: int = 5000,
+                 easyprivacy: str = EASYPRIVACY_RULES, easylist: str = EASYLIST_RULES) -> None:
+        self.db = db or crawler2db()
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.rule_files = (easyprivacy, easylist)
+        self.ruleset = ruleset_version(easyprivacy, easylist)
+
+    def _requests(self, run_id: int, connection):
+        page_url = func.coalesce(CrawlJob.url, literal("https://") + Website.domain)
+        stmt = (
+            select(NetworkRequest.website_id, NetworkRequest.request_id, NetworkRequest.url,
+                   NetworkRequest.resource_type, page_url, func.coalesce(CrawlJob.is_popup, False))
+            .join(Website, Website.website_id == NetworkRequest.website_id)
+            .outerjoin(CrawlJob, CrawlJob.website_id == NetworkRequest.website_id)
+            .where(NetworkRequest.run_id == run_id)
+        )
+        result = connection.execution_options(stream_results=True, yield_per=self.chunk_size).execute(stmt)
+        for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+
+    def replay(self, run_id: int) -> int:
+        """Classify every stored request of a run; returns the number of verdicts written"""
+        started = time.perf_counter()
+        written = 0
+        with self.db.engine.connect() as connection, concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_load_rules, initargs=self.rule_files) as executor:
+            pending = set()
+            for chunk in self._requests(run_id, connection):
+                pending.add(executor.submit(_classify_chunk, chunk))
+                # Keep a bounded number of chunks in flight so memory stays flat on large runs.
+                if len(pending) >= 2 * self.workers:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    written += self._store(run_id, done)
+            written += self._store(run_id, concurrent.futures.as_completed(pending))
+
+        elapsed = time.perf_counter() - started
+        logging.info(f"Replayed {written} requests of run {run_id} with rule set {self.ruleset} "
+                     f"in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.0f} requests/s)")
+        return written
+
+    def _store(self, run_id: int, futures) -> int:
+        written = 0
+        for future in futures:
+            written += self.db.add_analysis_results_bulk([
+                {
+                    'run_id': run_id,
+                    'website_id': website_id,
+                    'request_id': request_id,
+                    'ruleset': self.ruleset,
+                    'rule_id': rule_id,
+                    'decision': decision
+                } for website_id, request_id, decision, rule_id in future.result()
+            ])
+        return written
+
+
+if __name__ == "__main__":
+    from main import main
+
+    logging.basicConfig(level=logging.INFO)
+    # Same command as `main.py replay`, kept runnable on its own.
+    main(["replay", *sys.argv[1:]])
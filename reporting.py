@@ -0,0 +1,212 @@
+import csv
+import gzip
+import logging
+import sys
+from collections import Counter
+from typing import Optional
+from urllib.parse import urlparse
+
+from sqlalchemy import Numeric, cast, func, select
+from sqlalchemy.orm import aliased
+
+from crawlerdb import (AnalysisResult, Cookie, CrawlRun, LoadComparison, NetworkRequest, Website, WebsiteStats,
+                       crawler2db)
+from request_context import registrable_domain
+from settings import REPORTS
+
+
+class Reporter:
+    """SQL-side aggregate reports over crawl results.
+
+    Every report is a single SELECT that the database aggregates; results are streamed
+    to disk with a server-side cursor so memory stays flat however large the crawl.
+    Reports that need URL parsing (top_third_party_hosts) stream the request rows
+    instead and return (columns, rows), so they run on SQLite as well as Postgres.
+    """
+
+    REPORTS = REPORTS
+
+    def __init__(self, db: Optional[crawler2db] = None) -> None:
+        self.db = db or crawler2db()
+
+    @staticmethod
+    def _share(part, total, label: str):
+        return func.round(cast(part, Numeric) / func.nullif(total, 0), 4).label(label)
+
+    def category_ratios(self, run_id: Optional[int] = None):
+        """AD/TRACKER/SAFE counts and shares per website category, from the precomputed website_stats."""
+        ads = func.sum(WebsiteStats.ads).label("ads")
+        trackers = func.sum(WebsiteStats.trackers).label("trackers")
+        safe = func.sum(WebsiteStats.safe).label("safe")
+        total = func.sum(WebsiteStats.ads + WebsiteStats.trackers + WebsiteStats.safe)
+        stmt = (
+            select(Website.category, func.count().label("websites"), ads, trackers, safe,
+                   self._share(ads, total, "ad_ratio"),
+                   self._share(trackers, total, "tracker_ratio"),
+                   self._share(safe, total, "safe_ratio"))
+            .join(Website, Website.website_id == WebsiteStats.website_id)
+            .group_by(Website.category)
+            .order_by(Website.category)
+        )
+        return stmt.where(WebsiteStats.run_id == run_id) if run_id is not None else stmt
+
+    def website_ratios(self, run_id: Optional[int] = None):
+        """AD/TRACKER/SAFE counts and shares per website."""
+        total = WebsiteStats.ads + WebsiteStats.trackers + WebsiteStats.safe
+        stmt = (
+            select(WebsiteStats.run_id, Website.domain, Website.category,
+                   WebsiteStats.ads, WebsiteStats.trackers, WebsiteStats.safe,
+                   self._share(WebsiteStats.ads, total, "ad_ratio"),
+                   self._share(WebsiteStats.trackers, total, "tracker_ratio"),
+                   self._share(WebsiteStats.safe, total, "safe_ratio"))
+            .join(Website, Website.website_id == WebsiteStats.website_id)
+            .order_by(WebsiteStats.run_id, Website.domain)
+        )
+        return stmt.where(WebsiteStats.run_id == run_id) if run_id is not None else stmt
+
+    def top_rules(self, run_id: Optional[int] = None, limit: int = 100, ruleset: Optional[str] = None):
+        """Most frequently matched rule ids; TRACKER ids come from EasyPrivacy, AD ids from EasyList.
+
+        ruleset selects the verdicts of one rule-list version, e.g. a replay; by default
+        each run's crawl-time verdicts are counted.
+        """
+        stmt = (
+            select(AnalysisResult.decision, AnalysisResult.rule_id,
+                   func.count().label("matches"),
+                   func.count(AnalysisResult.website_id.distinct()).label("websites"))
+            .where(AnalysisResult.rule_id.isnot(None), AnalysisResult.decision != "SAFE")
+            .group_by(AnalysisResult.decision, AnalysisResult.rule_id)
+            .order_by(func.count().desc())
+            .limit(limit)
+        )
+        if ruleset is None:
+            stmt = (stmt.join(CrawlRun, CrawlRun.run_id == AnalysisResult.run_id)
+                    .where(AnalysisResult.ruleset == func.coalesce(CrawlRun.ruleset, '')))
+        else:
+            stmt = stmt.where(AnalysisResult.ruleset == ruleset)
+        return stmt.where(AnalysisResult.run_id == run_id) if run_id is not None else stmt
+
+    def top_third_party_hosts(self, run_id: Optional[int] = None, limit: int = 100, batch_size: int = 5000):
+        """Hosts requested most often by pages of a different registrable domain (eTLD+1).
+
+        Hosts are parsed here rather than in SQL, which has no portable URL functions or
+        public suffix list; the test is the classifier's RequestContext.third_party one.
+        Only the per-host tallies are kept in memory while the requests stream past.
+        """
+        stmt = (select(NetworkRequest.url, NetworkRequest.website_id, Website.domain)
+                .join(Website, Website.website_id == NetworkRequest.website_id))
+        if run_id is not None:
+            stmt = stmt.where(NetworkRequest.run_id == run_id)
+        requests, websites = Counter(), {}
+        with self.db.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+            for url, website_id, domain in result:
+                host = urlparse(url).hostname
+                if not host or registrable_domain(host) == registrable_domain(urlparse(f"//{domain}").hostname or ""):
+                    continue
+                requests[host] += 1
+                websites.setdefault(host, set()).add(website_id)
+        return ("host", "requests", "websites"), [(host, count, len(websites[host]))
+                                                  for host, count in requests.most_common(limit)]
+
+    def cookies_by_party(self, run_id: Optional[int] = None):
+        """Cookie counts by party, overall and per website category."""
+        stmt = (
+            select(Website.category, Cookie.party,
+                   func.count().label("cookies"),
+                   func.count(Cookie.website_id.distinct()).label("websites"))
+            .join(Website, Website.website_id == Cookie.website_id)
+            .group_by(Website.category, Cookie.party)
+            .order_by(Website.category, Cookie.party)
+        )
+        return stmt.where(Cookie.run_id == run_id) if run_id is not None else stmt
+
+    def load_cost(self, run_id: Optional[int] = None):
+        """Per site, what ads and trackers add to a page load: unblocked vs blocked timing, bytes and requests."""
+        unblocked, blocked = aliased(LoadComparison), aliased(LoadComparison)
+        stmt = (
+            select(unblocked.run_id, Website.domain, Website.category,
+                   unblocked.load_event_ms.label("unblocked_load_ms"),
+                   blocked.load_event_ms.label("blocked_load_ms"),
+                   (unblocked.load_event_ms - blocked.load_event_ms).label("load_ms_saved"),
+                   (unblocked.dom_content_loaded_ms - blocked.dom_content_loaded_ms).label("dcl_ms_saved"),
+                   unblocked.transferred_bytes.label("unblocked_bytes"),
+                   blocked.transferred_bytes.label("blocked_bytes"),
+                   self._share(unblocked.transferred_bytes - blocked.transferred_bytes,
+                               unblocked.transferred_bytes, "bytes_saved_ratio"),
+                   unblocked.requests.label("unblocked_requests"),
+                   blocked.requests.label("blocked_load_requests"),
+                   blocked.blocked_requests)
+            .join(blocked, (blocked.run_id == unblocked.run_id) & (blocked.website_id == unblocked.website_id)
+                  & (blocked.mode == "blocked"))
+            .join(Website, Website.website_id == unblocked.website_id)
+            .where(unblocked.mode == "unblocked")
+            .order_by(unblocked.run_id, Website.domain)
+        )
+        return stmt.where(unblocked.run_id == run_id) if run_id is not None else stmt
+
+    def _execute(self, connection, report: str, batch_size: int, params: dict) -> tuple:
+        """(column names, row batches) of a report; SELECT reports are streamed with a server-side cursor."""
+        query = getattr(self, report)(**params)
+        if isinstance(query, tuple):
+            columns, rows = query
+            return list(columns), [rows]
+        result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+        return list(result.keys()), result.partitions()
+
+    def fetch(self, report: str, **params) -> list:
+        """Run a report and return its rows; meant for small results such as top-N lists."""
+        with self.db.engine.connect() as connection:
+            return [row for batch in self._execute(connection, report, 5000, params)[1] for row in batch]
+
+    def export(self, report: str, path: str, **params) -> int:
+        """Export a report to CSV, or to Parquet when the path ends in .parquet; returns the row count."""
+        export = self.export_parquet if path.endswith(".parquet") else self.export_csv
+        return export(report, path, **params)
+
+    def export_csv(self, report: str, path: str, batch_size: int = 5000, **params) -> int:
+        """Stream a report into a CSV file (gzip-compressed if the path ends in .gz); returns the row count."""
+        opener = gzip.open if path.endswith(".gz") else open
+        rows = 0
+        with self.db.engine.connect() as connection, opener(path, "wt", newline="") as f:
+            columns, partitions = self._execute(connection, report, batch_size, params)
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for partition in partitions:
+                writer.writerows(partition)
+                rows += len(partition)
+        logging.info(f"Exported {rows} rows of {report} to {path}")
+        return rows
+
+    def export_parquet(self, report: str, path: str, batch_size: int = 5000, **params) -> int:
+        """Stream a report into a Parquet file, one row group per batch (requires pyarrow); returns the row count.
+
+        Column types are taken from the first batch.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows, writer = 0, None
+        with self.db.engine.connect() as connection:
+            columns, partitions = self._execute(connection, report, batch_size, params)
+            try:
+                for partition in partitions:
+                    table = pa.Table.from_pylist([dict(zip(columns, row)) for row in partition],
+                                                 schema=writer.schema if writer else None)
+                    writer = writer or pq.ParquetWriter(path, table.schema)
+                    writer.write_table(table)
+                    rows += len(partition)
+                if writer is None:
+                    pq.write_table(pa.table({column: [] for column in columns}), path)
+            finally:
+                if writer:
+                    writer.close()
+        logging.info(f"Exported {rows} rows of {report} to {path}")
+        return rows
+
+
+if __name__ == "__main__":
+    from main import main
+
+    # Same command as `main.py report`, kept runnable on its own.
+    main(["report", *sys.argv[1:]])
@@ -0,0 +1,120 @@
+import logging
+import time
+from typing import Callable, Optional
+
+import trio
+from selenium.common import TimeoutException
+
+from settings import MATCHER_INLINE_THREADS
+
+# Fetch.requestPaused events are dropped by Selenium when its channel is full, and a
+# dropped event leaves its request paused forever, so the channel is sized generously.
+EVENT_BUFFER = 4096
+BLOCKED_DECISIONS = ("AD", "TRACKER")
+
+NAVIGATION_TIMING_JS = """
+const nav = performance.getEntriesByType('navigation')[0];
+return nav ? {dom_content_loaded_ms: nav.domContentLoadedEventEnd, load_event_ms: nav.loadEventEnd} : {};
+"""
+
+
+class RequestBlocker:
+    """Loads a page through Chrome's Fetch domain, allowing or failing every request inline.
+
+    verdict(url, resource_type) returns the same (decision, rule_id) the analysis stage
+    stores; AD and TRACKER requests are failed with BlockedByClient when blocking. A load
+    without blocking goes through the same interception and verdicts, so both loads
+    carry the same overhead and can be compared. The browser cache is disabled for
+    both. Top-frame documents are never blocked.
+
+    A verdict that blocks (e.g. a round trip to the matcher service) must not stall
+    the event loop: with verdict_blocks set, each paused request is answered in its
+    own task and its verdict runs in one of MATCHER_INLINE_THREADS worker threads.
+    """
+
+    def __init__(self, driver, verdict: Callable[[str, str], tuple], verdict_blocks: bool = False) -> None:
+        self.driver = driver
+        self.verdict = verdict
+        self.verdict_blocks = verdict_blocks
+
+    def load(self, url: str, block: bool) -> dict:
+        """Navigate to url; returns navigation timing, transferred bytes and request counts"""
+        return trio.run(self._load, url, block)
+
+    async def _load(self, url: str, block: bool) -> dict:
+        stats = {"requests": 0, "matched_requests": 0, "blocked_requests": 0, "transferred_bytes": 0,
+                 "verdict_seconds": 0.0, "timed_out": False}
+        async with self.driver.bidi_connection() as connection:
+            session, devtools = connection.session, connection.devtools
+            top_frame = (await session.execute(devtools.page.get_frame_tree())).frame.id
+            await session.execute(devtools.network.enable())
+            await session.execute(devtools.network.set_cache_disabled(cache_disabled=True))
+            await session.execute(devtools.fetch.enable(patterns=[
+                devtools.fetch.RequestPattern(url_pattern="*", request_stage=devtools.fetch.RequestStage.REQUEST)
+            ]))
+            paused = session.listen(devtools.fetch.RequestPaused, buffer_size=EVENT_BUFFER)
+            finished = session.listen(devtools.network.LoadingFinished, buffer_size=EVENT_BUFFER)
+
+            failure = None
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(self._intercept, session, devtools, paused, top_frame, block, stats)
+                nursery.start_soon(self._count_bytes, finished, stats)
+                try:
+                    await trio.to_thread.run_sync(self.driver.get, url)
+                except TimeoutException:
+                    stats["timed_out"] = True
+                    await trio.to_thread.run_sync(self.driver.execute_script, "window.stop();")
+                except Exception as e:
+                    failure = e
+                nursery.cancel_scope.cancel()
+
+            await session.execute(devtools.fetch.disable())
+            await session.execute(devtools.network.set_cache_disabled(cache_disabled=False))
+        if failure:
+            raise failure
+        stats.update(self.driver.execute_script(NAVIGATION_TIMING_JS) or {})
+        return stats
+
+    async def _intercept(self, session, devtools, paused, top_frame: str, block: bool, stats: dict) -> None:
+        limiter = trio.CapacityLimiter(MATCHER_INLINE_THREADS)
+        async with trio.open_nursery() as answers:
+            async for event in paused:
+                if self.verdict_blocks:
+                    answers.start_soon(self._answer, session, devtools, event, top_frame, block, stats, limiter)
+                else:
+                    await self._answer(session, devtools, event, top_frame, block, stats)
+
+    async def _answer(self, session, devtools, event, top_frame: str, block: bool, stats: dict,
+                      limiter: Optional[trio.CapacityLimiter] = None) -> None:
+        """Classify one paused request and let Chrome continue or fail it"""
+        stats["requests"] += 1
+        resource_type = event.resource_type.value.lower()
+        if resource_type == "document" and event.frame_id != top_frame:
+            resource_type = "subdocument"
+        blocked = False
+        if resource_type != "document":
+            started = time.perf_counter()
+            if limiter:
+                decision, _ = await trio.to_thread.run_sync(self.verdict, event.request.url, resource_type,
+                                                            limiter=limiter, abandon_on_cancel=True)
+            else:
+                decision, _ = self.verdict(event.request.url, resource_type)
+            stats["verdict_seconds"] += time.perf_counter() - started
+            if decision in BLOCKED_DECISIONS:
+                stats["matched_requests"] += 1
+                blocked = block
+        try:
+            if blocked:
+                stats["blocked_requests"] += 1
+                await session.execute(devtools.fetch.fail_request(
+                    request_id=event.request_id, error_reason=devtools.network.ErrorReason.BLOCKED_BY_CLIENT))
+            else:
+                await session.execute(devtools.fetch.continue_request(request_id=event.request_id))
+        except Exception as e:
+            # The request's frame may be gone by the time we answer.
+            logging.debug(f"Could not resume paused request {event.request.url}: {e}")
+
+    @staticmethod
+    async def _count_bytes(finished, stats: dict) -> None:
+        async for event in finished:
+            stats["transferred_bytes"] += int(event.encoded_data_length)
@@ -0,0 +1,111 @@
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from urllib.parse import urlparse
+
+from settings import PUBLIC_SUFFIX_LIST
+
+# One bit per request type understood in rule options ($script, $image, ...).
+REQUEST_TYPES = ["script", "image", "stylesheet", "object", "xmlhttprequest", "object-subrequest", "subdocument",
+                 "document", "other", "background", "xbl", "ping", "dtd", "media", "websocket"]
+TYPE_BITS = {name: 1 << index for index, name in enumerate(REQUEST_TYPES)}
+
+# Chrome DevTools resource types that are named differently in rule options.
+CDP_TYPES = {
+    "xhr": "xmlhttprequest",
+    "fetch": "xmlhttprequest",
+    "font": "other",
+    "prefetch": "other",
+    "manifest": "other",
+    "texttrack": "media",
+    "eventsource": "xmlhttprequest",
+    "cspviolationreport": "ping",
+    "signedexchange": "other",
+    "preflight": "other",
+}
+
+
+class PublicSuffixList:
+    """Offline public suffix list (bundled public_suffix_list.dat) for registrable-domain lookups"""
+
+    def __init__(self, path: str = PUBLIC_SUFFIX_LIST) -> None:
+        self.rules, self.wildcards, self.exceptions = set(), set(), set()
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                rule = line.strip().split(" ")[0]
+                if not rule or rule.startswith("//"):
+                    continue
+                rule = rule.encode("idna").decode("ascii") if not rule.isascii() else rule
+                if rule.startswith("!"):
+                    self.exceptions.add(rule[1:])
+                elif rule.startswith("*."):
+                    self.wildcards.add(rule[2:])
+                else:
+                    self.rules.add(rule)
+        self.registrable_domain = lru_cache(maxsize=65536)(self._registrable_domain)
+
+    def _registrable_domain(self, host: str) -> str:
+        """eTLD+1 of a host, e.g. news.bbc.co.uk -> bbc.co.uk; IP addresses and bare suffixes are returned as is"""
+        if not host or host.replace(".", "").isdigit() or ":" in host:
+            return host
+        labels = host.split(".")
+        suffix_length = 1
+        for index in range(len(labels)):
+            candidate = ".".join(labels[index:])
+            if candidate in self.exceptions:
+                suffix_length = len(labels) - index - 1
+                break
+            if candidate in self.rules or ".".join(labels[index + 1:]) in self.wildcards:
+                suffix_length = len(labels) - index
+                break
+        if suffix_length >= len(labels):
+            return host
+        return ".".join(labels[-suffix_length - 1:])
+
+
+_public_suffixes = {}
+
+
+def registrable_domain(host: str) -> str:
+    """eTLD+1 of a host from the bundled public suffix list (loaded on first use)"""
+    if "list" not in _public_suffixes:
+        _public_suffixes["list"] = PublicSuffixList()
+    return _public_suffixes["list"].registrable_domain(host)
+
+
+class RequestContext(NamedTuple):
+    """Everything the matchers need to know about one request, computed once.
+
+    Immutable and hashable, so it also serves as the verdict cache key.
+    """
+    url: str
+    url_lower: str
+    host: str
+    domain: str
+    page_host: Optional[str]
+    page_domain: Optional[str]
+    third_party: bool
+    resource_type: str
+    type_mask: int
+    is_popup: bool
+
+    @classmethod
+    def build(cls, url: str, resource_type: str = "other", page_url: Optional[str] = None,
+              is_popup: bool = False) -> "RequestContext":
+        host = (urlparse(url).hostname or "").lower()
+        domain = registrable_domain(host)
+        page_host = (urlparse(page_url).hostname or "").lower() if page_url else None
+        page_domain = registrable_domain(page_host) if page_host else None
+        resource_type = resource_type.lower()
+        resource_type = CDP_TYPES.get(resource_type, resource_type)
+        return cls(
+            url=url,
+            url_lower=url.lower(),
+            host=host,
+            domain=domain,
+            page_host=page_host,
+            page_domain=page_domain,
+            third_party=page_domain is not None and domain != page_domain,
+            resource_type=resource_type,
+            type_mask=TYPE_BITS.get(resource_type, TYPE_BITS["other"]),
+            is_popup=bool(is_popup),
+        )
@@ -1,3 +1,4 @@
+import hashlib
 import itertools
 import re
 import json
@@ -134,3 +135,22 @@ class ELParser:
         """Load rules from JSON file"""
         with open(filename, 'r') as f:
             self.rules = json.load(f)
+
+
+def parser_version() -> str:
+    """Fingerprint of the parser code and option table; JSON parsed by another version is stale"""
+    digest = hashlib.sha256()
+    with open(__file__, 'rb') as f:
+        digest.update(f.read())
+    digest.update(json.dumps(BINARY_OPTIONS).encode())
+    return digest.hexdigest()[:16]
+
+
+def ruleset_version(*json_files: str) -> str:
+    """Short fingerprint of parsed rule lists, used to tag the analysis results they produced"""
+    digest = hashlib.sha256()
+    for filename in json_files:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
@@ -0,0 +1,50 @@
+import time
+from typing import Optional
+
+from settings import STAGE_BUDGET_SHARES
+
+
+class SiteBudget:
+    """Wall-clock deadline for a single site, split across the crawl stages.
+
+    Each stage gets its share of whatever time is left when it starts, so time
+    saved by a fast stage rolls over into the later ones.
+    """
+
+    def __init__(self, total_seconds: float, shares: Optional[dict] = None) -> None:
+        self.shares = shares or STAGE_BUDGET_SHARES
+        self.deadline = time.monotonic() + total_seconds
+        self.stage = None
+        self.stage_deadline = self.deadline
+        self.started = []
+        self.timed_out = []
+
+    def start_stage(self, name: str) -> float:
+        """Begin a stage and return the seconds allotted to it."""
+        order = list(self.shares)
+        pending = [stage for stage in order[order.index(name):] if stage not in self.started]
+        weight = sum(self.shares[stage] for stage in pending) or 1
+        allotted = self.remaining_total() * self.shares[name] / weight
+
+        if name not in self.started:
+            self.started.append(name)
+        self.stage = name
+        self.stage_deadline = time.monotonic() + allotted
+        return allotted
+
+    def remaining_total(self) -> float:
+        """Seconds left for the whole site."""
+        return max(0.0, self.deadline - time.monotonic())
+
+    def remaining(self) -> float:
+        """Seconds left in the current stage."""
+        return max(0.0, min(self.stage_deadline, self.deadline) - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def mark_timed_out(self, stage: Optional[str] = None) -> None:
+        """Record that a stage ran out of time and only produced partial results."""
+        stage = stage or self.stage
+        if stage not in self.timed_out:
+            self.timed_out.append(stage)
@@ -1,50 +1,115 @@
-from selenium.webdriver.common.by import By
-
-
 ESSENTIAL_DIRS = {
-    "lists": "data\\rules_lists\\lists",
-    "parsed_rules": "data\\rules_lists\\parsed_rules",
-    "websites": "data\\websites",
+    "lists": "data/rules_lists/Lists",
+    "parsed_rules": "data/rules_lists/parsed_rules",
+    "websites": "data/websites",
 }
 
+PUBLIC_SUFFIX_LIST = "public_suffix_list.dat"
+EASYLIST_RULES = "data/rules_lists/parsed_rules/EasyList.json"
+EASYPRIVACY_RULES = "data/rules_lists/parsed_rules/EasyPrivacy.json"
+
+# "by" values are Selenium locator strategies (By.ID == "id", By.XPATH == "xpath"),
+# spelled out so that importing settings does not load Selenium.
 COOKIES_BUTTON_SELECTORS = [
-    {"by": By.ID, "value": "acceptAll"},
-    {"by": By.ID, "value": "consent-accept"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'Accept')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'Agree')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'Consent')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'Allow')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'I accept')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'OK')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'Accept all')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'accept all')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'Accept All')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'I agree')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'Continue')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'Yes')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'X')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'Yes, I accept')]"},
-    {"by": By.XPATH, "value": "//button[contains(text(), 'Confirm My Choices')]"},
-    {"by": By.XPATH, "value": "//a[contains(text(), 'Agree and Proceed')]"},
-    {"by": By.XPATH, "value": "//button[contains(@class, 'accept-btn')]"},
-    {"by": By.XPATH, "value": "//a[contains(@class, 'btn_yes') and @href='#' and @role='button']"},
-    {"by": By.XPATH, "value": "//a[contains(@class, 'cookies-button')]"},
-    {"by": By.XPATH, "value": "//button[contains(@id, 'accept') or contains(@id, 'agree')]"},
-    {"by": By.XPATH, "value": "//button[@aria-label='Yes, I accept']"},
-    {"by": By.XPATH, "value": "//button[@aria-label='accept-cookies']"},
-    {"by": By.XPATH, "value": "//button[@aria-label='Accept cookies']"},
-    {"by": By.XPATH, "value": "//button[@aria-label='Accept all cookies']"},
-    {"by": By.XPATH, "value": "//button[@aria-label='I accept cookies']"},
-    {"by": By.XPATH, "value": "//button[@aria-label='I agree to the use of cookies']"},
-    {"by": By.XPATH, "value": "//button[@aria-label='Agree']"},
-    {"by": By.XPATH, "value": "//button[@aria-label='OK']"},
-    {"by": By.XPATH, "value": "//button[@aria-label='Continue']"},
-    {"by": By.XPATH, "value": "//button[@aria-label='Yes']"},
-    {"by": By.XPATH, "value": "//button[@aria-label='Accept']"},
+    {"by": "id", "value": "acceptAll"},
+    {"by": "id", "value": "consent-accept"},
+    {"by": "xpath", "value": "//button[contains(text(), 'Accept')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'Agree')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'Consent')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'Allow')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'I accept')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'OK')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'Accept all')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'accept all')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'Accept All')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'I agree')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'Continue')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'Yes')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'X')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'Yes, I accept')]"},
+    {"by": "xpath", "value": "//button[contains(text(), 'Confirm My Choices')]"},
+    {"by": "xpath", "value": "//a[contains(text(), 'Agree and Proceed')]"},
+    {"by": "xpath", "value": "//button[contains(@class, 'accept-btn')]"},
+    {"by": "xpath", "value": "//a[contains(@class, 'btn_yes') and @href='#' and @role='button']"},
+    {"by": "xpath", "value": "//a[contains(@class, 'cookies-button')]"},
+    {"by": "xpath", "value": "//button[contains(@id, 'accept') or contains(@id, 'agree')]"},
+    {"by": "xpath", "value": "//button[@aria-label='Yes, I accept']"},
+    {"by": "xpath", "value": "//button[@aria-label='accept-cookies']"},
+    {"by": "xpath", "value": "//button[@aria-label='Accept cookies']"},
+    {"by": "xpath", "value": "//button[@aria-label='Accept all cookies']"},
+    {"by": "xpath", "value": "//button[@aria-label='I accept cookies']"},
+    {"by": "xpath", "value": "//button[@aria-label='I agree to the use of cookies']"},
+    {"by": "xpath", "value": "//button[@aria-label='Agree']"},
+    {"by": "xpath", "value": "//button[@aria-label='OK']"},
+    {"by": "xpath", "value": "//button[@aria-label='Continue']"},
+    {"by": "xpath", "value": "//button[@aria-label='Yes']"},
+    {"by": "xpath", "value": "//button[@aria-label='Accept']"},
 ]
 
+CRAWL_STAGES = ["logs", "media", "cookies", "analysis"]
+
+JOB_LEASE_SECONDS = 900
+JOB_HEARTBEAT_SECONDS = 60
+
+SITE_TIME_BUDGET = 600
+STAGE_BUDGET_SHARES = {
+    "load": 0.20,
+    "consent": 0.10,
+    "capture": 0.05,
+    "download": 0.25,
+    "cookies": 0.10,
+    "analysis": 0.30,
+}
+# Budget share of the extra stage that loads each site unblocked and blocked (block mode "compare").
+COMPARE_STAGE_SHARE = 0.25
+BLOCK_MODES = ("block", "compare")
+MIN_PAGE_LOAD_TIMEOUT = 15
+MAX_PAGE_LOAD_TIMEOUT = 120
+LOAD_TIMEOUT_FACTOR = 3
+# Weight of the newest page-load time in a site's exponential moving average (CrawlJob.load_seconds).
+LOAD_TIME_EMA_ALPHA = 0.3
+TIMEOUT_DEMOTION_THRESHOLD = 2
+
+WRITER_BATCH_ROWS = 500
+WRITER_QUEUE_SIZE = 10000
+WRITER_FLUSH_SECONDS = 1.0
+
+# Sized for the crawler's analysis threads plus the writer and heartbeat connections.
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 30
+DB_POOL_TIMEOUT = 30
+DB_POOL_RECYCLE = 1800
+
+CATEGORY_LOOKUP_URL = "https://sitelookup.mcafee.com/en/feedback/url"
+CATEGORY_CACHE_TTL = 30 * 24 * 3600
+CATEGORIZER_WORKERS = 4
+CATEGORY_LOOKUP_TIMEOUT = 10
+
+# Generated patterns with more '.*' segments than this are evaluated piecewise (see checker.compile_rule).
+MAX_RULE_WILDCARDS = 3
+PROFILE_TOP_N = 20
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+METRICS_RATE_WINDOW = 60
+
+MATCHER_HOST = "127.0.0.1"
+MATCHER_PORT = 8765
+# Worker threads answering paused requests with matcher-service round trips (block mode with --matcher-url).
+MATCHER_INLINE_THREADS = 8
+
+ARTIFACTS_DIR = "data/artifacts"
+
+# Reports reporting.Reporter can export (main.py report / reporting.py).
+REPORTS = ("category_ratios", "website_ratios", "top_rules", "top_third_party_hosts", "cookies_by_party",
+           "load_cost")
+
+BENCHMARK_DIR = "data/benchmarks"
+BENCHMARK_SYNTHETIC_URLS = 20000
+BENCHMARK_MAX_SLOWDOWN = 0.25
+
 RULES_LISTS = {
-    "Easyprivacy": {
+    "EasyPrivacy": {
         "description": "Blocks tracking scripts and analytics (Google Analytics, Facebook Pixel)",
         "url": "https://easylist.to/easylist/easyprivacy.txt"
     },
@@ -69,7 +134,46 @@ RULES_FORMAT = {
 }
 
 __all__ = [
+    "PUBLIC_SUFFIX_LIST",
+    "EASYLIST_RULES",
+    "EASYPRIVACY_RULES",
     "COOKIES_BUTTON_SELECTORS",
+    "CRAWL_STAGES",
+    "JOB_LEASE_SECONDS",
+    "JOB_HEARTBEAT_SECONDS",
+    "SITE_TIME_BUDGET",
+    "STAGE_BUDGET_SHARES",
+    "COMPARE_STAGE_SHARE",
+    "BLOCK_MODES",
+    "MIN_PAGE_LOAD_TIMEOUT",
+    "MAX_PAGE_LOAD_TIMEOUT",
+    "LOAD_TIMEOUT_FACTOR",
+    "LOAD_TIME_EMA_ALPHA",
+    "TIMEOUT_DEMOTION_THRESHOLD",
+    "WRITER_BATCH_ROWS",
+    "WRITER_QUEUE_SIZE",
+    "WRITER_FLUSH_SECONDS",
+    "DB_POOL_SIZE",
+    "DB_MAX_OVERFLOW",
+    "DB_POOL_TIMEOUT",
+    "DB_POOL_RECYCLE",
+    "CATEGORY_LOOKUP_URL",
+    "CATEGORY_CACHE_TTL",
+    "CATEGORIZER_WORKERS",
+    "CATEGORY_LOOKUP_TIMEOUT",
+    "MAX_RULE_WILDCARDS",
+    "PROFILE_TOP_N",
+    "METRICS_HOST",
+    "METRICS_PORT",
+    "METRICS_RATE_WINDOW",
+    "MATCHER_HOST",
+    "MATCHER_PORT",
+    "MATCHER_INLINE_THREADS",
+    "ARTIFACTS_DIR",
+    "REPORTS",
+    "BENCHMARK_DIR",
+    "BENCHMARK_SYNTHETIC_URLS",
+    "BENCHMARK_MAX_SLOWDOWN",
     "RULES_LISTS",
     "ESSENTIAL_DIRS",
     "BINARY_OPTIONS",
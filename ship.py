@@ -0,0 +1,184 @@
+import csv
+import io
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import or_, select, union
+
+from crawlerdb import (AnalysisResult, ConsentSelectorStat, ConsentStrategy, Cookie, CrawlRun, DownloadedFile,
+                       LoadComparison, NetworkRequest, NetworkResponse, ShippedRun, ShippedSelectorStat, Website,
+                       WebsiteStats, crawler2db)
+
+# Foreign-key order; cookie ids are surrogate keys and are re-generated by the target.
+SHIPPED_TABLES = [
+    (NetworkRequest, ()),
+    (NetworkResponse, ()),
+    (DownloadedFile, ()),
+    (AnalysisResult, ()),
+    (Cookie, ("cookie_id",)),
+    (WebsiteStats, ()),
+    (LoadComparison, ()),
+]
+COPY_NULL = r"\N"
+
+
+def _copy_value(value):
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class Shipper:
+    """Ships crawl runs from a local (SQLite) crawl database into the central Postgres store.
+
+    Websites are matched by domain and runs get fresh ids in the target, so databases
+    crawled independently on several nodes can all be shipped into the same store.
+    Only the websites of the shipped runs are sent, and a website's status never moves
+    backwards: a newer visit updates it, but a 'completed' site stays completed.
+    Rows are streamed out of the source and loaded with COPY in chunks of batch_size,
+    in the same target transaction that creates the runs, so a failed ship leaves
+    nothing behind. The source remembers what it has shipped, so shipping it again
+    only sends runs finished since, and only the consent selector hits recorded since.
+    """
+
+    def __init__(self, source: crawler2db, target: Optional[crawler2db] = None, batch_size: int = 10000) -> None:
+        self.source = source
+        self.target = target or crawler2db()
+        self.batch_size = batch_size
+        if not self.target.is_postgres:
+            raise ValueError("Crawl data can only be shipped into a Postgres database")
+
+    def ship(self) -> dict:
+        """Copy every finished run not shipped before into the target; returns {source run_id: target run_id}"""
+        self._merge_consent()
+        runs = self.source.session.scalars(
+            select(CrawlRun).where(CrawlRun.finished_at.isnot(None), CrawlRun.run_id.not_in(select(ShippedRun.run_id)))
+        ).all()
+        if not runs:
+            return {}
+
+        try:
+            website_ids = self._map_websites([run.run_id for run in runs])
+            run_ids = self._map_runs(runs)
+            # COPY through the session's own connection, so it commits or rolls back with the new runs.
+            with self.target.session.connection().connection.cursor() as cursor:
+                for model, skipped in SHIPPED_TABLES:
+                    rows = self._copy_table(cursor, model, skipped, website_ids, run_ids)
+                    logging.info(f"Shipped {rows} rows of {model.__tablename__}")
+            self.target.session.commit()
+        except Exception:
+            self.target.session.rollback()
+            raise
+
+        shipped_at = datetime.now(timezone.utc)
+        self.source.session.add_all(ShippedRun(run_id=run_id, target_run_id=target_run_id, shipped_at=shipped_at)
+                                    for run_id, target_run_id in run_ids.items())
+        self.source.session.commit()
+        return run_ids
+
+    def _map_websites(self, run_ids: list) -> dict:
+        shipped_sites = union(*(select(model.website_id).where(model.run_id.in_(run_ids))
+                                for model, _ in SHIPPED_TABLES))
+        domains = {
+            website.domain: website
+            for website in self.source.session.scalars(select(Website).where(Website.website_id.in_(shipped_sites)))
+        }
+        if domains:
+            stmt = self.target._insert(Website).values([
+                {
+                    'domain': domain,
+                    'visited_status': website.visited_status,
+                    'visit_timestamp': website.visit_timestamp,
+                    'category': website.category
+                } for domain, website in domains.items()
+            ])
+            self.target.session.execute(stmt.on_conflict_do_update(
+                index_elements=['domain'],
+                set_={column: stmt.excluded[column] for column in ('visited_status', 'visit_timestamp', 'category')},
+                where=(or_(Website.visit_timestamp.is_(None), stmt.excluded.visit_timestamp > Website.visit_timestamp)
+                       & or_(Website.visited_status != 'completed', stmt.excluded.visited_status == 'completed'))
+            ))
+        target_ids = dict(self.target.session.execute(
+            select(Website.domain, Website.website_id).where(Website.domain.in_(domains))
+        ).all())
+        return {website.website_id: target_ids[domain] for domain, website in domains.items()}
+
+    def _map_runs(self, runs: list) -> dict:
+        run_ids = {}
+        for run in runs:
+            shipped = CrawlRun(started_at=run.started_at, finished_at=run.finished_at, worker_id=run.worker_id,
+                               ruleset=run.ruleset)
+            self.target.session.add(shipped)
+            self.target.session.flush()
+            self.target.create_run_partitions(shipped.run_id)
+            run_ids[run.run_id] = shipped.run_id
+        return run_ids
+
+    def _merge_consent(self) -> None:
+        for strategy in self.source.session.scalars(select(ConsentStrategy)):
+            selector = {"by": strategy.selector_by, "value": strategy.selector_value} if strategy.selector_by else None
+            self.target.save_consent_strategy(strategy.domain, selector, strategy.needs_popup_handling)
+        shipped_hits = {
+            (stat.selector_by, stat.selector_value): stat
+            for stat in self.source.session.scalars(select(ShippedSelectorStat))
+        }
+        for stat in self.source.session.scalars(select(ConsentSelectorStat)):
+            shipped = shipped_hits.get((stat.selector_by, stat.selector_value))
+            new_hits = stat.hits - (shipped.hits if shipped else 0)
+            if new_hits <= 0:
+                continue
+            stmt = self.target._insert(ConsentSelectorStat).values(
+                selector_by=stat.selector_by, selector_value=stat.selector_value, hits=new_hits
+            )
+            self.target.session.execute(stmt.on_conflict_do_update(
+                index_elements=['selector_by', 'selector_value'],
+                set_={'hits': ConsentSelectorStat.hits + stmt.excluded.hits}
+            ))
+            if shipped:
+                shipped.hits = stat.hits
+            else:
+                self.source.session.add(ShippedSelectorStat(
+                    selector_by=stat.selector_by, selector_value=stat.selector_value, hits=stat.hits
+                ))
+        self.target.session.commit()
+        self.source.session.commit()
+
+    def _copy_table(self, cursor, model, skipped, website_ids: dict, run_ids: dict) -> int:
+        table = model.__table__
+        columns = [column.name for column in table.columns if column.name not in skipped]
+        sql = (f"COPY {table.name} ({', '.join(columns)}) FROM STDIN "
+               f"WITH (FORMAT csv, NULL '{COPY_NULL}')")
+        stmt = select(*(table.c[name] for name in columns)).where(table.c.run_id.in_(run_ids))
+
+        shipped = 0
+        with self.source.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=self.batch_size).execute(stmt)
+            for partition in result.mappings().partitions():
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in partition:
+                    row = dict(row, run_id=run_ids[row['run_id']], website_id=website_ids[row['website_id']])
+                    writer.writerow([_copy_value(row[name]) for name in columns])
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                shipped += len(partition)
+        return shipped
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 2:
+        sys.exit("usage: python ship.py <sqlite file or database URL>")
+    source_url = sys.argv[1] if "://" in sys.argv[1] else f"sqlite:///{sys.argv[1]}"
+
+    source = crawler2db(source_url)
+    shipper = Shipper(source)
+    for source_run, target_run in shipper.ship().items():
+        print(f"run {source_run} -> {target_run}")
+    source.close()
+    shipper.target.close()
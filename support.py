@@ -1,13 +1,22 @@
 import json
+import os
 import requests
+from settings import ESSENTIAL_DIRS
 
 
 def rule_list_downloader(lists: dict) -> None:
     for _list, link in lists.items():
-        result = requests.get(link["url"])
-        open(f"data\\rules_lists\\Lists\\{_list}.txt", "w+", encoding="utf-8").write(result.text)
+        download_rule_list(_list, link["url"])
     return
 
+
+def download_rule_list(name: str, url: str) -> str:
+    """Download one rule list into the lists directory; returns its path"""
+    result = requests.get(url)
+    path = os.path.join(ESSENTIAL_DIRS["lists"], f"{name}.txt")
+    open(path, "w+", encoding="utf-8").write(result.text)
+    return path
+
 def load_from_json(self, filename: str) -> None:
     """Load rules from JSON file"""
     with open(filename, 'r') as f:
@@ -15,5 +24,6 @@ def load_from_json(self, filename: str) -> None:
 
 __all__ = [
     "rule_list_downloader",
+    "download_rule_list",
     "load_from_json",
 ]
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawlerdb import crawler2db  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A crawler2db on an empty SQLite file"""
+    database = crawler2db(f"sqlite:///{tmp_path / 'crawl.sqlite'}")
+    yield database
+    database.close()
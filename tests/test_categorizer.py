@@ -0,0 +1,64 @@
+import os
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from categorizer import Categorizer
+
+CATEGORIES = {"news.example": ["News", "Portals"], "shop.example": ["Online Shopping"]}
+with open(os.path.join(os.path.dirname(__file__), "fixtures", "category_lookup.html"), "r") as f:
+    LOOKUP_PAGE = f.read()
+
+
+@pytest.fixture
+def lookup_url():
+    """Serve the stand-in lookup page on a free local port"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = parse_qs(urlparse(self.path).query).get("url", [""])[0]
+            categories = CATEGORIES.get(urlparse(url).netloc or url, [])
+            payload = LOOKUP_PAGE.replace("{url}", url).replace(
+                "{categories}", "<br>".join(f"- {category}" for category in categories)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/en/feedback/url"
+    server.shutdown()
+    server.server_close()
+
+
+def _lines(path):
+    with open(path, "r") as f:
+        return sorted(f.read().splitlines())
+
+
+def test_cached_categories_are_written_without_a_browser(db, tmp_path, lookup_url):
+    db.save_domain_category("news.example", ["News"])
+    categorizer = Categorizer(db, workers=1, lookup_url=lookup_url)
+    output = tmp_path / "categorized.txt"
+
+    assert categorizer.categorize(["https://news.example"], str(output)) == 1
+    assert _lines(output) == ["https://news.example ::: News"]
+    assert categorizer.categorize(["https://news.example"], str(output)) == 0
+
+
+@pytest.mark.skipif(not any(shutil.which(name) for name in ("google-chrome", "chromium", "chromium-browser", "chrome")),
+                    reason="needs a local Chrome")
+def test_lookup_against_the_stand_in_page(db, tmp_path, lookup_url):
+    categorizer = Categorizer(db, workers=2, lookup_url=lookup_url)
+    output = tmp_path / "categorized.txt"
+
+    assert categorizer.categorize(["https://news.example", "https://shop.example"], str(output)) == 2
+    assert _lines(output) == ["https://news.example ::: News,Portals", "https://shop.example ::: Online Shopping"]
+    assert db.get_cached_categories(["news.example"], 3600) == {"news.example": ["News", "Portals"]}
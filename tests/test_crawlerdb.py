@@ -0,0 +1,100 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+from crawlerdb import AnalysisResult, Cookie, DownloadedFile, NetworkRequest, NetworkResponse
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _request(run_id, website_id, request_id, url="https://ads.example.com/x.js"):
+    return {'run_id': run_id, 'website_id': website_id, 'request_id': request_id, 'url': url, 'method': 'GET',
+            'resource_type': 'script', 'timestamp': NOW}
+
+
+def _response(run_id, website_id, response_id, status_code=200):
+    return {'run_id': run_id, 'website_id': website_id, 'response_id': response_id, 'status_code': status_code,
+            'headers': {'Content-Type': 'text/javascript'}, 'security_state': 'Secure', 'timestamp': NOW}
+
+
+def _count(db, model):
+    return db.session.scalar(select(func.count()).select_from(model))
+
+
+def test_each_site_is_claimed_by_one_worker(db):
+    db.enqueue_websites([("https://a.com", "News"), ("https://b.com", "Shopping")])
+    first = db.claim_next_website(3, "worker-1", 900)
+    second = db.claim_next_website(3, "worker-2", 900)
+
+    assert {first.url, second.url} == {"https://a.com", "https://b.com"}
+    assert db.claim_next_website(3, "worker-3", 900) is None
+    assert (first.lease_owner, first.attempts) == ("worker-1", 1)
+
+
+def test_expired_lease_is_reclaimed_and_the_old_holder_loses_it(db):
+    db.enqueue_websites([("https://a.com", "News")])
+    job = db.claim_next_website(3, "worker-1", -1)
+
+    reclaimed = db.claim_next_website(3, "worker-2", 900)
+    assert reclaimed.website_id == job.website_id
+    assert reclaimed.attempts == 2
+    assert not db.heartbeat(job.website_id, "worker-1", 900)
+    assert db.heartbeat(job.website_id, "worker-2", 900)
+
+
+def test_released_site_within_its_retry_budget_is_claimed_again(db):
+    db.enqueue_websites([("https://a.com", "News")])
+    job = db.claim_next_website(2, "worker-1", 900)
+    db.release_job(job.website_id, "worker-1")
+    assert db.claim_next_website(2, "worker-1", 900).website_id == job.website_id
+
+    db.release_job(job.website_id, "worker-1")
+    assert db.claim_next_website(2, "worker-1", 900) is None
+
+
+def test_resumed_site_keeps_the_run_of_its_checkpoint(db):
+    first_run, second_run = db.start_run("worker-1"), db.start_run("worker-1")
+    db.enqueue_websites([("https://a.com", "News")])
+    job = db.claim_next_website(3, "worker-1", 900, first_run)
+    db.save_checkpoint(job.website_id, "logs")
+    db.release_job(job.website_id, "worker-1")
+
+    resumed = db.claim_next_website(3, "worker-1", 900, second_run)
+    assert (resumed.run_id, resumed.stage) == (first_run, "logs")
+
+
+def test_bulk_writers_deduplicate_and_skip_orphans(db):
+    run_id, website_id = db.start_run("worker-1"), db.add_website("a.com")
+
+    assert db.add_requests_bulk([_request(run_id, website_id, "1"), _request(run_id, website_id, "1", "https://b/"),
+                                 _request(run_id, website_id, "2")]) == 2
+    assert db.session.get(NetworkRequest, (run_id, website_id, "1")).url == "https://ads.example.com/x.js"
+
+    assert db.add_responses_bulk([_response(run_id, website_id, "1"), _response(run_id, website_id, "1", 304),
+                                  _response(run_id, website_id, "missing")]) == 1
+    response = db.session.get(NetworkResponse, (run_id, website_id, "1"))
+    assert (response.status_code, response.security_state, response.headers) == (
+        304, 'secure', {'content-type': 'text/javascript'})
+
+    files = [{'run_id': run_id, 'website_id': website_id, 'request_id': request_id, 'response_id': request_id,
+              'file_type': 'js', 'file_path': f'/tmp/{request_id}.js'} for request_id in ("1", "2")]
+    assert db.add_downloaded_files_bulk(files) == 1
+    assert _count(db, DownloadedFile) == 1
+
+    verdicts = [{'run_id': run_id, 'website_id': website_id, 'request_id': "1", 'rule_id': rule_id,
+                 'decision': 'AD'} for rule_id in (7, 9)]
+    assert db.add_analysis_results_bulk(verdicts) == 1
+    assert db.session.scalar(select(AnalysisResult.rule_id)) == 9
+
+
+def test_cookies_are_upserted_per_run(db):
+    run_id, website_id = db.start_run("worker-1"), db.add_website("a.com")
+    cookie = {'name': 'id', 'domain': '.a.com', 'value': 'v1', 'party': 'first'}
+
+    db.add_cookies_bulk(website_id, [cookie], run_id)
+    db.add_cookies_bulk(website_id, [dict(cookie, value='v2')], run_id)
+    assert _count(db, Cookie) == 1
+    assert db.session.scalar(select(Cookie.value)) == 'v2'
+
+    db.add_cookies_bulk(website_id, [cookie], db.start_run("worker-1"))
+    assert _count(db, Cookie) == 2
@@ -0,0 +1,64 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from metrics import CrawlMetrics, MetricsServer
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    return CrawlMetrics(run_id="test", directory=str(tmp_path))
+
+
+def _scrape(server, path="/metrics"):
+    with urllib.request.urlopen(f"http://127.0.0.1:{server.server.server_port}{path}", timeout=5) as response:
+        return response.headers["Content-Type"], response.read().decode()
+
+
+def test_scrape_exports_counters_stages_and_gauges(metrics):
+    metrics.start_site(1, "https://a.com")
+    for depth in (5, 7):
+        with metrics.stage("capture"):
+            metrics.count("db_rows", 3)
+            metrics.gauge("writer_queue_depth", depth)
+    metrics.increment("sites_completed")
+
+    server = MetricsServer(metrics, host="127.0.0.1", port=0)
+    server.add_gauge("crawler_in_flight_sites", lambda: 2, '{worker="w1"}')
+    server.add_gauge("crawler_unavailable", lambda: None)
+    server.start()
+    try:
+        content_type, body = _scrape(server)
+    finally:
+        server.stop()
+
+    lines = body.splitlines()
+    assert content_type.startswith("text/plain")
+    assert "# TYPE crawler_db_rows_total counter" in lines
+    assert "crawler_db_rows_total 6" in lines
+    assert "crawler_sites_completed_total 1" in lines
+    assert 'crawler_stage_duration_seconds_count{stage="capture"} 2' in lines
+    assert 'crawler_in_flight_sites{worker="w1"} 2' in lines
+    assert not any("writer_queue_depth" in line or "crawler_unavailable" in line for line in lines)
+
+
+def test_unknown_path_is_not_found(metrics):
+    server = MetricsServer(metrics, host="127.0.0.1", port=0).start()
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            _scrape(server, "/")
+    finally:
+        server.stop()
+    assert error.value.code == 404
+
+
+def test_summary_reports_gauge_peaks_instead_of_sums(metrics):
+    for depth in (5, 7, 2):
+        with metrics.stage("capture"):
+            metrics.count("db_rows", 3)
+            metrics.gauge("writer_queue_depth", depth)
+
+    summary = CrawlMetrics.summarize(metrics.path)["capture"]
+    assert (summary["sites"], summary["db_rows"], summary["writer_queue_depth_max"]) == (3, 9, 7)
+    assert "writer_queue_depth" not in summary